@@ -62,6 +62,8 @@ CACHES = {
         'LOCATION': 'redis://redis:6379/1',
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # The cache only speeds things up; a Redis outage must not fail requests
+            'IGNORE_EXCEPTIONS': True,
         }
     }
 }
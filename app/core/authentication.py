@@ -1,24 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import timedelta
+from typing import Optional
+
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.authtoken.models import Token
+from django.core.cache import cache
 from django.utils import timezone
-from .constants import AUTH_TOKEN_LIFETIME
+from .constants import AUTH_TOKEN_LIFETIME, AUTH_TOKEN_CACHE_SECONDS, AUTH_TOKEN_LOCAL_CACHE_SECONDS, AUTH_TOKEN_LOCAL_CACHE_SIZE
+
+TOKEN_CACHE_PREFIX = 'auth_token'
+
+
+class _LocalTokenCache:
+    """
+    Small per-process LRU in front of Redis. Invalidation only reaches the process
+    that performs it, so entries live just a few seconds.
+    """
+
+    def __init__(self, size: int, seconds: float):
+        self.size = size
+        self.seconds = seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Token]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            token, stored_at = entry
+            if time.monotonic() - stored_at > self.seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return token
+
+    def set(self, key: str, token: Token) -> None:
+        with self._lock:
+            self._entries[key] = (token, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+local_token_cache = _LocalTokenCache(AUTH_TOKEN_LOCAL_CACHE_SIZE, AUTH_TOKEN_LOCAL_CACHE_SECONDS)
+
+
+def _token_cache_key(key: str) -> str:
+    return f"{TOKEN_CACHE_PREFIX}:{key}"
+
+
+def invalidate_token(key: str) -> None:
+    """Drop a token from both cache levels (see core.signals for the callers)."""
+    local_token_cache.delete(key)
+    cache.delete(_token_cache_key(key))
+
 
 class ExpiringTokenAuthentication(TokenAuthentication):
     token_lifetime = timedelta(minutes=AUTH_TOKEN_LIFETIME)
 
     def authenticate_credentials(self, key):
-        try:
-            token = Token.objects.select_related('user').get(key=key)
-        except Token.DoesNotExist:
-            raise AuthenticationFailed('Invalid token.')
+        token = self._cached_token(key)
 
         if not token.user.is_active:
             raise AuthenticationFailed('Inactive or deleted user.')
 
         if timezone.now() - token.created > self.token_lifetime:
-            token.delete()
+            # Deleting the token also invalidates its cache entries
+            Token.objects.filter(key=token.key).delete()
             raise AuthenticationFailed('Expired token. Try to make login again.')
 
-        return (token.user, token)
\ No newline at end of file
+        return (token.user, token)
+
+    def _cached_token(self, key: str) -> Token:
+        # The token is cached with its user, so a hit costs no query at all. The
+        # password hash is deferred: it is never pickled into Redis, and is only
+        # loaded if something asks for it. Saving a user with a deferred field only
+        # writes the loaded fields, so the hash cannot be overwritten either.
+        token = local_token_cache.get(key)
+        if token is not None:
+            return token
+
+        token = cache.get(_token_cache_key(key))
+        if token is None:
+            try:
+                token = Token.objects.select_related('user').defer('user__password').get(key=key)
+            except Token.DoesNotExist:
+                raise AuthenticationFailed('Invalid token.')
+            # Never cache a token beyond its own expiry
+            remaining = (token.created + self.token_lifetime - timezone.now()).total_seconds()
+            if remaining > 0:
+                cache.set(_token_cache_key(key), token, timeout=min(AUTH_TOKEN_CACHE_SECONDS, remaining))
+
+        local_token_cache.set(key, token)
+        return token
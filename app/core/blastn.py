@@ -0,0 +1,105 @@
+# core/blastn.py
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import shutil
+import subprocess
+from typing import Dict, List
+
+from .execution import cancellation_check
+from .instrumentation import StageRecorder
+from .storage import analysis_storage_dir
+from .strategies import AnalysisExecutionResult
+from .tool_runner import ToolRunner
+
+logger = logging.getLogger(__name__)
+
+BLASTN_HITS_OUTFMT = '6 qseqid sseqid pident length evalue bitscore'
+
+
+def run_blastn(analysis_id: int, parameters: dict, num_threads: int = 1) -> AnalysisExecutionResult:
+    """
+    Run a homology search published by HomologySearchStrategy. Executed inside the
+    blastn worker's process pool, so it must not touch the database outside of the
+    cancellation check, which runs on the tool runner's own thread and connection.
+    """
+    runner = ToolRunner(should_cancel=cancellation_check(analysis_id))
+    recorder = StageRecorder()
+    storage_dir = analysis_storage_dir(analysis_id)
+    query_path = os.path.join(storage_dir, 'blastn_query.fasta')
+    archive_path = os.path.join(storage_dir, 'blastn_archive.fmt11')
+
+    _write_query_fasta(parameters['sequences'], query_path)
+
+    cmd = [
+        'blastn',
+        '-db', parameters['database'],
+        '-query', query_path,
+        '-evalue', str(parameters['evalue']),
+        '-gapopen', str(parameters['gap_open']),
+        '-gapextend', str(parameters['gap_extend']),
+        '-penalty', str(parameters['penalty']),
+        '-num_threads', str(num_threads),
+        '-outfmt', '11',
+        '-out', archive_path,
+    ]
+    with recorder.stage('blastn', inputs=[query_path], outputs=[archive_path], runner=runner):
+        runner.run(cmd, threads=num_threads)
+
+    with recorder.stage('blast_formatter', inputs=[archive_path], runner=runner) as timing:
+        hits = _format_hits(runner, archive_path)
+        timing.bytes_out = len(json.dumps(hits))
+
+    gz_path = f"{archive_path}.gz"
+    with recorder.stage('gzip', inputs=[archive_path], outputs=[gz_path]):
+        _gzip(archive_path)
+
+    return AnalysisExecutionResult(
+        command=' '.join(cmd),
+        result=hits,
+        file=gz_path,
+        stages=recorder.stages,
+    )
+
+
+def _write_query_fasta(sequences: list, fasta_out: str) -> None:
+    with open(fasta_out, 'w', encoding='utf-8') as fh:
+        for i, seq in enumerate(sequences, start=1):
+            if isinstance(seq, dict):
+                seq_id = seq.get('id') or f'query_{i}'
+                bases = seq.get('sequence', '')
+            else:
+                seq_id, bases = f'query_{i}', seq
+            fh.write(f">{seq_id}\n{bases}\n")
+
+
+def _format_hits(runner: ToolRunner, archive_path: str) -> List[Dict]:
+    cmd = ['blast_formatter', '-archive', archive_path, '-outfmt', BLASTN_HITS_OUTFMT]
+
+    hits = []
+    with runner.open(cmd, stdout=subprocess.PIPE) as proc:
+        for line in proc.stdout:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            query, subject, pident, length, evalue, bitscore = line.split('\t')
+            hits.append({
+                'query': query,
+                'subject': subject,
+                'identity': float(pident),
+                'length': int(length),
+                'evalue': float(evalue),
+                'bitscore': float(bitscore),
+            })
+    return hits
+
+
+def _gzip(path: str) -> str:
+    gz_path = f"{path}.gz"
+    with open(path, 'rb') as f_in, gzip.open(gz_path, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(path)
+    return gz_path
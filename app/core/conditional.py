@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, quote_etag
+from rest_framework.response import Response
+
+RESPONSE_CACHE_PREFIX = 'response'
+
+
+class ConditionalRetrieveMixin:
+    """
+    ETag for retrieve, derived from the latest updated_at of the object and of the
+    related rows its representation nests (version_relations), so a repeat read costs
+    one small query and returns 304 when the client is up to date. There is no
+    Last-Modified: its one-second resolution would hide changes within a second.
+
+    Objects whose status is in cached_statuses no longer change once there, so their
+    serialized representation is also kept in the response cache. Keys carry the
+    ETag, which makes every save invalidate them.
+    """
+    cached_statuses = ()
+    version_relations = ()
+
+    def retrieve(self, request, *args, **kwargs):
+        version = self._object_version()
+        if version is None or version['updated_at'] is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        updated_at = max(
+            version[key] for key in ['updated_at'] + self._relation_keys() if version[key] is not None
+        )
+        etag = quote_etag(f"{self.basename}-{version['pk']}-{updated_at.timestamp()}")
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self._cached_retrieve(request, version, etag, *args, **kwargs)
+
+        response['ETag'] = etag
+        # Representations are per user: shared caches must not store them
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _cached_retrieve(self, request, version, etag, *args, **kwargs):
+        if version.get('status') not in self.cached_statuses:
+            return super().retrieve(request, *args, **kwargs)
+
+        key = f"{RESPONSE_CACHE_PREFIX}:{request.user.pk}:{etag}"
+        data = cache.get(key)
+        if data is None:
+            data = super().retrieve(request, *args, **kwargs).data
+            cache.set(key, data, timeout=settings.CACHE_TTL)
+        return Response(data)
+
+    def _object_version(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        fields = ['pk', 'updated_at'] + (['status'] if self.cached_statuses else [])
+        # Only the version columns: the full object is loaded on a cache miss
+        try:
+            return (
+                self.get_queryset()
+                .prefetch_related(None)
+                .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+                .values(*fields)
+                .annotate(**{
+                    key: Max(f'{relation}__updated_at')
+                    for key, relation in zip(self._relation_keys(), self.version_relations)
+                })
+                .first()
+            )
+        except (TypeError, ValueError):
+            # Malformed lookup: let retrieve answer 404 as it would have
+            return None
+
+    def _relation_keys(self):
+        return [f'{relation}_updated_at' for relation in self.version_relations]
@@ -1,23 +1,136 @@
 import os 
 
-PAIRWISE_ALIGNMENT_COMMAND_TEMPLATE = '''from Bio.Align import PairwiseAligner
+PAIRWISE_ALIGNER_COMMAND_TEMPLATE = '''from Bio.Align import PairwiseAligner
 aligner = PairwiseAligner()
 aligner.mode = "{mode}"
 aligner.match_score = {match_score}
 aligner.mismatch_score = {mismatch_score}
 aligner.open_gap_score = {open_gap_score}
 aligner.extend_gap_score = {extend_gap_score}
-alignments = aligner.align("{sequence_a}", "{sequence_b}")
 '''
 
+PAIRWISE_ALIGNMENT_COMMAND_TEMPLATE = PAIRWISE_ALIGNER_COMMAND_TEMPLATE + '''alignments = aligner.align("{sequence_a}", "{sequence_b}")
+'''
+
+PAIRWISE_SCORE_COMMAND_TEMPLATE = PAIRWISE_ALIGNER_COMMAND_TEMPLATE + '''score = aligner.score("{sequence_a}", "{sequence_b}")
+'''
+
+PAIRWISE_BATCH_COMMAND_TEMPLATE = PAIRWISE_ALIGNER_COMMAND_TEMPLATE + '''scores = [[aligner.score(query, target) for target in targets] for query in queries]
+'''
+
+PAIRWISE_BATCH_MAX_SEQUENCES = int(os.environ.get('PAIRWISE_BATCH_MAX_SEQUENCES', 500))
+PAIRWISE_BATCH_MAX_SEQUENCE_LENGTH = int(os.environ.get('PAIRWISE_BATCH_MAX_SEQUENCE_LENGTH', 2000))
+PAIRWISE_BATCH_PROCESSES = int(os.environ.get('PAIRWISE_BATCH_PROCESSES', os.cpu_count() or 1))
+# Dynamic-programming cells (sum of len(query) * len(target) over the scored pairs)
+# a batch may cost, whatever the split between sequence count and length
+PAIRWISE_BATCH_MAX_CELLS = int(os.environ.get('PAIRWISE_BATCH_MAX_CELLS', 10 ** 10))
+
+# Maximum length of each sequence per pairwise output mode. Building the traceback
+# takes memory proportional to len(a) * len(b); the score alone needs only O(n).
+PAIRWISE_MAX_SEQUENCE_LENGTH = {
+    'all': int(os.environ.get('PAIRWISE_MAX_SEQUENCE_LENGTH_ALL', 5000)),
+    'single': int(os.environ.get('PAIRWISE_MAX_SEQUENCE_LENGTH_SINGLE', 10000)),
+    'score_only': int(os.environ.get('PAIRWISE_MAX_SEQUENCE_LENGTH_SCORE_ONLY', 1000000)),
+}
+# Time is O(len(a) * len(b)) in every mode and alignments run inside the request, so
+# the product is bounded too. This is what limits score_only, whose long sequences
+# are meant to be paired with short ones.
+PAIRWISE_MAX_CELLS = int(os.environ.get('PAIRWISE_MAX_CELLS', 2 * 10 ** 8))
+
+PAIRWISE_DEFAULT_MAX_ALIGNMENTS = 100
+PAIRWISE_MAX_ALIGNMENTS = 1000
+# Regenerating alignments walks the traceback from the first one, so deep pages cost more
+PAIRWISE_MAX_PAGE_OFFSET = 100000
+PAIRWISE_MAX_PAGE_SIZE = 100
+
 BLAST_DB_PATHS = {
     'default': '/blast/db/environmental_bacteria_db'
 }
 
 BLASTN_EXCHANGE = os.environ.get('RABBITMQ_BLASTN_EXCHANGE_NAME')
 BLASTN_ROUTING_KEY = os.environ.get('RABBITMQ_BLASTN_ROUTING_KEY')
+BLASTN_QUEUE = os.environ.get('RABBITMQ_BLASTN_QUEUE_NAME')
+
+TAXONOMY_TREE_EXCHANGE = os.environ.get('RABBITMQ_TAXONOMY_TREE_EXCHANGE_NAME')
+TAXONOMY_TREE_ROUTING_KEY = os.environ.get('RABBITMQ_TAXONOMY_TREE_ROUTING_KEY')
+TAXONOMY_TREE_QUEUE = os.environ.get('RABBITMQ_TAXONOMY_TREE_QUEUE_NAME')
+
+PAIRWISE_BATCH_EXCHANGE = os.environ.get('RABBITMQ_PAIRWISE_BATCH_EXCHANGE_NAME')
+PAIRWISE_BATCH_ROUTING_KEY = os.environ.get('RABBITMQ_PAIRWISE_BATCH_ROUTING_KEY')
+PAIRWISE_BATCH_QUEUE = os.environ.get('RABBITMQ_PAIRWISE_BATCH_QUEUE_NAME')
+
+# Env var prefixes of the exchanges and queues above. initialize_rabbitmq, which every
+# service runs first, declares them and refuses to start while one is incomplete.
+RABBITMQ_QUEUE_PREFIXES = ('RABBITMQ_BLASTN', 'RABBITMQ_TAXONOMY_TREE', 'RABBITMQ_PAIRWISE_BATCH')
+RABBITMQ_QUEUE_SETTINGS = ('EXCHANGE_NAME', 'EXCHANGE_TYPE', 'ROUTING_KEY', 'QUEUE_NAME')
+
+RABBITMQ_HOST = os.environ.get('RABBITMQ_HOST', 'rabbitmq')
+RABBITMQ_PORT = int(os.environ.get('RABBITMQ_PORT', 5672))
 
 RABBITMQ_DEFAULT_USER = os.environ.get('RABBITMQ_DEFAULT_USER')
 RABBITMQ_DEFAULT_PASS = os.environ.get('RABBITMQ_DEFAULT_PASS')
 
-AUTH_TOKEN_LIFETIME = int(os.environ.get('AUTH_TOKEN_LIFETIME', 30))
\ No newline at end of file
+# Consumers reconnect after losing the broker, doubling the wait up to the maximum
+RABBITMQ_RECONNECT_SECONDS = float(os.environ.get('RABBITMQ_RECONNECT_SECONDS', 1))
+RABBITMQ_RECONNECT_MAX_SECONDS = float(os.environ.get('RABBITMQ_RECONNECT_MAX_SECONDS', 30))
+
+# Threads given to each MSA / tree job, and the input size above which the
+# multithreaded engines are picked by default
+TAXONOMY_TREE_CPU_BUDGET = int(os.environ.get('TAXONOMY_TREE_CPU_BUDGET', os.cpu_count() or 1))
+TAXONOMY_TREE_LARGE_INPUT_SEQUENCES = int(os.environ.get('TAXONOMY_TREE_LARGE_INPUT_SEQUENCES', 500))
+
+# Limits applied to every external tool (blastn, blast_formatter, MSA and tree
+# engines). Zero disables a limit. The CPU limit is per thread the tool is given.
+TOOL_TIMEOUT_SECONDS = int(os.environ.get('TOOL_TIMEOUT_SECONDS', 4 * 60 * 60))
+TOOL_MEMORY_LIMIT_MB = int(os.environ.get('TOOL_MEMORY_LIMIT_MB', 16 * 1024))
+TOOL_CPU_LIMIT_SECONDS = int(os.environ.get('TOOL_CPU_LIMIT_SECONDS', 24 * 60 * 60))
+TOOL_NICE = int(os.environ.get('TOOL_NICE', 10))
+TOOL_IONICE_CLASS = int(os.environ.get('TOOL_IONICE_CLASS', 2))
+TOOL_IONICE_LEVEL = int(os.environ.get('TOOL_IONICE_LEVEL', 7))
+TOOL_POLL_INTERVAL_SECONDS = float(os.environ.get('TOOL_POLL_INTERVAL_SECONDS', 2))
+
+# Workers refresh heartbeat_at of their STARTED analyses this often. Analyses whose
+# heartbeat is older than ANALYSIS_STALE_SECONDS lost their worker and are failed.
+ANALYSIS_HEARTBEAT_SECONDS = float(os.environ.get('ANALYSIS_HEARTBEAT_SECONDS', 30))
+ANALYSIS_STALE_SECONDS = float(os.environ.get('ANALYSIS_STALE_SECONDS', 5 * 60))
+
+STORAGE_FILE = os.environ.get('STORAGE_FILE', '/mnt/data/blastn_storage')
+
+# Artifacts shared between tree builds are evicted least recently used first once the
+# cache exceeds this size, and regardless of size once unused for this long
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get('ARTIFACT_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+ARTIFACT_CACHE_MAX_AGE_SECONDS = int(os.environ.get('ARTIFACT_CACHE_MAX_AGE_SECONDS', 30 * 24 * 60 * 60))
+
+AUTH_TOKEN_LIFETIME = int(os.environ.get('AUTH_TOKEN_LIFETIME', 30))
+
+# Authenticated tokens are cached with their user, minus the password hash, in Redis
+# and, for a few seconds, in a per-process LRU. Logout, user changes and expiry
+# invalidate both.
+AUTH_TOKEN_CACHE_SECONDS = int(os.environ.get('AUTH_TOKEN_CACHE_SECONDS', 5 * 60))
+AUTH_TOKEN_LOCAL_CACHE_SECONDS = float(os.environ.get('AUTH_TOKEN_LOCAL_CACHE_SECONDS', 5))
+AUTH_TOKEN_LOCAL_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_LOCAL_CACHE_SIZE', 1024))
+
+# Idle analysis status streams send a comment line this often
+ANALYSIS_EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('ANALYSIS_EVENTS_HEARTBEAT_SECONDS', 15))
+# Status streams end after this long, and clients reconnect after the retry delay;
+# see notifications.status_events
+ANALYSIS_EVENTS_MAX_SECONDS = float(os.environ.get('ANALYSIS_EVENTS_MAX_SECONDS', 5 * 60))
+ANALYSIS_EVENTS_RETRY_SECONDS = float(os.environ.get('ANALYSIS_EVENTS_RETRY_SECONDS', 3))
+
+# Largest page_size a client may request from the experiment and analysis lists
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 100))
+
+# The results list inlines results up to this size; the entries of larger ones are
+# paged through the result entries endpoint, at most RESULTS_MAX_PAGE_SIZE at a time
+RESULTS_INLINE_MAX_BYTES = int(os.environ.get('RESULTS_INLINE_MAX_BYTES', 1024 * 1024))
+RESULTS_MAX_PAGE_SIZE = int(os.environ.get('RESULTS_MAX_PAGE_SIZE', 1000))
+RESULTS_MAX_PAGE_OFFSET = 10 ** 9
+
+# The metrics endpoint requires METRICS_TOKEN as a bearer token when it is set, and
+# otherwise only answers clients on these networks. It aggregates the stages recorded
+# in the last METRICS_WINDOW_SECONDS.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_NETWORKS = os.environ.get(
+    'METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16',
+).split(',')
+METRICS_WINDOW_SECONDS = int(os.environ.get('METRICS_WINDOW_SECONDS', 60 * 60))
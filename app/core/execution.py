@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Callable, Iterator, Optional, Set
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast, Length
+from django.utils import timezone
+
+from .constants import ANALYSIS_HEARTBEAT_SECONDS, ANALYSIS_STALE_SECONDS
+from .models import Analysis, AnalysisStatusChoices, AnalysisInput, AnalysisOutput, AnalysisStageTiming
+from .strategies import AnalysisExecutionResult
+from .tool_runner import ToolCancelled
+
+logger = logging.getLogger(__name__)
+
+
+def store_execution_result(analysis: Analysis, execution: AnalysisExecutionResult) -> None:
+    analysis.status = AnalysisStatusChoices.SUCCEEDED
+    analysis.save(update_fields=['status'])
+
+    analysis_input = AnalysisInput.objects.create(
+        command=execution.command,
+        analysis=analysis,
+    )
+
+    output = AnalysisOutput.objects.create(
+        results=execution.result,
+        file=execution.file,
+        input=analysis_input,
+    )
+    if execution.result is not None:
+        # Measured on the stored jsonb, as the 0008 backfill does, rather than serializing twice
+        AnalysisOutput.objects.filter(pk=output.pk).update(
+            results_size=Length(Cast('results', output_field=TextField())),
+        )
+
+    AnalysisStageTiming.objects.bulk_create(
+        AnalysisStageTiming(analysis=analysis, **vars(timing))
+        for timing in execution.stages
+    )
+
+
+def start_analysis(analysis_id: int, redelivered: bool = False) -> Optional[Analysis]:
+    """
+    Move a queued analysis to STARTED. Returns None if the message should be discarded.
+
+    A redelivered message may find its analysis STARTED by a worker that lost its
+    broker connection or died. Unless that worker still beats, the analysis is
+    taken over and run again.
+    """
+    close_old_connections()
+    analysis = Analysis.objects.filter(pk=analysis_id).first()
+    if analysis is None:
+        logger.warning("Analysis %s not found, discarding message", analysis_id)
+        return None
+    if redelivered and analysis.status == AnalysisStatusChoices.STARTED and _take_over(analysis):
+        logger.warning("Analysis %s was redelivered and its worker stopped beating, restarting it", analysis_id)
+        return analysis
+    if analysis.status != AnalysisStatusChoices.WAITING:
+        logger.warning("Analysis %s is %s, discarding message", analysis_id, analysis.status)
+        return None
+
+    analysis.status = AnalysisStatusChoices.STARTED
+    analysis.heartbeat_at = timezone.now()
+    analysis.save(update_fields=['status', 'heartbeat_at'])
+    return analysis
+
+
+def _take_over(analysis: Analysis) -> bool:
+    # A live job beats every ANALYSIS_HEARTBEAT_SECONDS; two missed beats mean it is gone.
+    # The conditional update makes sure only one worker takes the analysis over.
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=2 * ANALYSIS_HEARTBEAT_SECONDS)
+    taken = Analysis.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True),
+        pk=analysis.pk, status=AnalysisStatusChoices.STARTED,
+    ).update(heartbeat_at=now)
+    analysis.heartbeat_at = now
+    return taken == 1
+
+
+def finish_analysis(analysis: Analysis, execution: AnalysisExecutionResult) -> None:
+    close_old_connections()
+    with transaction.atomic():
+        if _is_cancelled(analysis):
+            logger.info("Analysis %s was cancelled, discarding its results", analysis.id)
+            return
+        store_execution_result(analysis, execution)
+
+
+def fail_analysis(analysis: Analysis) -> None:
+    close_old_connections()
+    with transaction.atomic():
+        if _is_cancelled(analysis):
+            return
+        analysis.status = AnalysisStatusChoices.FAILED
+        analysis.save(update_fields=['status'])
+
+
+def cancellation_check(analysis_id: int) -> Callable[[], bool]:
+    """Build a ToolRunner.should_cancel callback. It runs on the runner's watchdog thread."""
+    def is_cancelled() -> bool:
+        try:
+            return Analysis.objects.filter(pk=analysis_id, status=AnalysisStatusChoices.CANCELLED).exists()
+        finally:
+            # The watchdog thread must not keep a connection of its own open
+            connection.close()
+    return is_cancelled
+
+
+def _is_cancelled(analysis: Analysis) -> bool:
+    # Lock the row so a concurrent cancel cannot slip in between the check and the save
+    status = Analysis.objects.select_for_update().values_list('status', flat=True).get(pk=analysis.pk)
+    return status == AnalysisStatusChoices.CANCELLED
+
+
+class AnalysisHeartbeat:
+    """
+    Refreshes heartbeat_at of the analyses a worker process is running, from a
+    background thread with its own connection. A worker that dies stops beating and
+    reap_stale_analyses fails its analyses instead of leaving them STARTED forever.
+    """
+
+    def __init__(self, interval: float = ANALYSIS_HEARTBEAT_SECONDS):
+        self.interval = interval
+        self._analysis_ids: Set[int] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, analysis_id: int) -> None:
+        with self._lock:
+            self._analysis_ids.add(analysis_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='analysis-heartbeat', daemon=True)
+                self._thread.start()
+
+    def discard(self, analysis_id: int) -> None:
+        with self._lock:
+            self._analysis_ids.discard(analysis_id)
+
+    @contextmanager
+    def beating(self, analysis_id: int) -> Iterator[None]:
+        self.add(analysis_id)
+        try:
+            yield
+        finally:
+            self.discard(analysis_id)
+
+    def beat(self) -> None:
+        with self._lock:
+            analysis_ids = list(self._analysis_ids)
+        if not analysis_ids:
+            return
+        # update() skips save(): the beat must neither bump updated_at nor publish a status
+        Analysis.objects.filter(
+            pk__in=analysis_ids, status=AnalysisStatusChoices.STARTED,
+        ).update(heartbeat_at=timezone.now())
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.beat()
+            except Exception:
+                logger.warning("Could not refresh analysis heartbeats", exc_info=True)
+            finally:
+                connection.close()
+
+
+heartbeat = AnalysisHeartbeat()
+
+
+def reap_stale_analyses(stale_after: float = ANALYSIS_STALE_SECONDS) -> int:
+    """Fail STARTED analyses whose worker stopped sending heartbeats. Returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    # Rows started before heartbeats existed only have updated_at to go by
+    stale = Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, updated_at__lt=cutoff)
+    candidates = list(
+        Analysis.objects.filter(stale, status=AnalysisStatusChoices.STARTED).values_list('pk', flat=True)
+    )
+
+    reaped = 0
+    for analysis_id in candidates:
+        with transaction.atomic():
+            # Re-checked under the lock: the worker may have beaten or finished meanwhile
+            analysis = (
+                Analysis.objects.select_for_update()
+                .filter(stale, pk=analysis_id, status=AnalysisStatusChoices.STARTED)
+                .first()
+            )
+            if analysis is None:
+                continue
+            logger.warning("Analysis %s has no heartbeat since %s, failing it", analysis_id, analysis.heartbeat_at)
+            analysis.status = AnalysisStatusChoices.FAILED
+            analysis.save(update_fields=['status'])
+            reaped += 1
+    return reaped
+
+
+def run_async_analysis(analysis_id: int, perform: Callable[[Analysis], AnalysisExecutionResult],
+                       redelivered: bool = False) -> None:
+    """Run a queued analysis in a worker, moving it through STARTED to SUCCEEDED or FAILED."""
+    analysis = start_analysis(analysis_id, redelivered)
+    if analysis is None:
+        return
+
+    try:
+        with heartbeat.beating(analysis.id):
+            execution = perform(analysis)
+        finish_analysis(analysis, execution)
+    except ToolCancelled:
+        logger.info("Analysis %s cancelled", analysis_id)
+    except Exception:
+        logger.exception("Analysis %s failed", analysis_id)
+        fail_analysis(analysis)
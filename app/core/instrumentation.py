@@ -0,0 +1,92 @@
+# core/instrumentation.py
+from __future__ import annotations
+
+import os
+import resource
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+
+from .tool_runner import ToolRunner
+
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+
+@dataclass
+class StageTiming:
+    stage: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_kb: int = 0
+    bytes_in: Optional[int] = None
+    bytes_out: Optional[int] = None
+
+
+class StageRecorder:
+    """
+    Records wall time, CPU time, peak RSS and input/output sizes of the stages of one
+    analysis. CPU time covers this process and the children reaped during the stage.
+
+    Peak RSS is the largest of this process' peak during the stage (Linux resets it at
+    each stage start; elsewhere it is the process' lifetime peak), the peaks wait4
+    reported for the tools the stage's runner ran, and any value the body set on the
+    timing, e.g. for its own pool processes.
+    """
+
+    def __init__(self):
+        self.stages: List[StageTiming] = []
+
+    @contextmanager
+    def stage(self, name: str, inputs: Iterable[str] = (), outputs: Iterable[str] = (),
+              runner: Optional[ToolRunner] = None) -> Iterator[StageTiming]:
+        """
+        Time the body as stage name. inputs/outputs are file paths whose sizes are
+        recorded; stages working in memory can set bytes_in/bytes_out on the yielded
+        timing instead. Pass the runner of stages that run external tools.
+        """
+        timing = StageTiming(stage=name, bytes_in=self._size(inputs))
+        tools_before = len(runner.peak_rss_kb) if runner is not None else 0
+        self._reset_peak_rss()
+        started = time.monotonic()
+        cpu_started = self._cpu_seconds()
+        yield timing
+        timing.wall_seconds = time.monotonic() - started
+        timing.cpu_seconds = self._cpu_seconds() - cpu_started
+        tool_peaks = runner.peak_rss_kb[tools_before:] if runner is not None else []
+        timing.peak_rss_kb = max([timing.peak_rss_kb, self._peak_rss_kb(), *tool_peaks])
+        if timing.bytes_out is None:
+            timing.bytes_out = self._size(outputs)
+        self.stages.append(timing)
+
+    def _reset_peak_rss(self) -> None:
+        # Writing 5 to clear_refs resets VmHWM to the current RSS (Linux 4.0+)
+        try:
+            with open(PROC_CLEAR_REFS, 'w') as fh:
+                fh.write('5')
+        except OSError:
+            pass
+
+    def _peak_rss_kb(self) -> int:
+        try:
+            with open(PROC_STATUS) as fh:
+                for line in fh:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def _cpu_seconds(self) -> float:
+        total = 0.0
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            usage = resource.getrusage(who)
+            total += usage.ru_utime + usage.ru_stime
+        return total
+
+    def _size(self, paths: Iterable[str]) -> Optional[int]:
+        paths = list(paths)
+        if not paths:
+            return None
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
@@ -0,0 +1,73 @@
+"""
+Django command to benchmark the gapped-row construction of pairwise alignments.
+"""
+import itertools
+import random
+import time
+
+from Bio.Align import PairwiseAligner
+from django.core.management.base import BaseCommand
+
+from core.strategies import PairwiseAlignmentStrategy
+
+
+def legacy_add_gaps(seq, aligned):
+    """Previous per-block Python implementation, kept as the benchmark baseline."""
+    result = []
+    last_end = 0
+    for start, end in aligned:
+        result.append('-' * (start - last_end))
+        result.append(seq[start:end])
+        last_end = end
+    result.append('-' * (len(seq) - last_end))
+    return ''.join(result)
+
+
+class Command(BaseCommand):
+    """Django command to compare the legacy and vectorized gapped-row builders."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alignments', type=int, default=2000, help='Alignments per sequence length.')
+        parser.add_argument('--lengths', type=int, nargs='+', default=[50, 200, 1000], help='Sequence lengths to test.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        strategy = PairwiseAlignmentStrategy()
+        rng = random.Random(options['seed'])
+
+        aligner = PairwiseAligner()
+        aligner.mode = 'global'
+        aligner.match_score = 1
+        aligner.mismatch_score = -1
+        aligner.open_gap_score = -1
+        aligner.extend_gap_score = -0.5
+
+        for length in options['lengths']:
+            alignments = []
+            # Collect co-optimal alignments from several random pairs until we have enough
+            while len(alignments) < options['alignments']:
+                seq_a = ''.join(rng.choice('ACGT') for _ in range(length))
+                seq_b = ''.join(rng.choice('ACGT') for _ in range(int(length * 0.9)))
+                alignments.extend(itertools.islice(aligner.align(seq_a, seq_b), options['alignments'] - len(alignments)))
+
+            start = time.perf_counter()
+            legacy = [
+                (legacy_add_gaps(aln.target, aln.aligned[0]), legacy_add_gaps(aln.query, aln.aligned[1]))
+                for aln in alignments
+            ]
+            legacy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            vectorized = [strategy._gapped_rows(aln) for aln in alignments]
+            vectorized_time = time.perf_counter() - start
+
+            if legacy != vectorized:
+                self.stderr.write(self.style.ERROR(f'length={length}: outputs differ'))
+                continue
+
+            self.stdout.write(
+                f'length={length} alignments={len(alignments)} '
+                f'legacy={legacy_time:.4f}s vectorized={vectorized_time:.4f}s '
+                f'speedup={legacy_time / vectorized_time:.1f}x'
+            )
@@ -0,0 +1,131 @@
+"""
+Django command to benchmark the hot query paths as the analysis tables grow.
+"""
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from core.models import (
+    Experiment,
+    Analysis,
+    AnalysisInput,
+    AnalysisOutput,
+    AnalysisStatusChoices,
+    AnalysisTypeChoices,
+)
+
+BATCH_SIZE = 10000
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Django command that seeds analyses in steps and times the queries behind the
+    experiment and analysis lists, the parent output lookup and the active-status
+    lookup after each step. Flat timings across steps mean the indexes are used.
+    Everything runs in a transaction that is rolled back unless --keep is given.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', type=int, nargs='+', default=[10000, 100000, 1000000],
+                            help='Total analyses to reach before each measurement.')
+        parser.add_argument('--users', type=int, default=1000, help='Users the analyses are spread over.')
+        parser.add_argument('--experiments-per-user', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query; the median is reported.')
+        parser.add_argument('--explain', action='store_true', help='Print the query plans after the last step.')
+        parser.add_argument('--keep', action='store_true', help='Commit the seeded rows instead of rolling back.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        try:
+            with transaction.atomic():
+                self._run(options)
+                if not options['keep']:
+                    raise Rollback()
+        except Rollback:
+            self.stdout.write('Rolled back seeded rows')
+
+    def _run(self, options):
+        users = User.objects.bulk_create(
+            User(username=f'benchmark_{time.time_ns()}_{i}') for i in range(options['users'])
+        )
+        experiments = Experiment.objects.bulk_create(
+            Experiment(title='benchmark', description='', user=user)
+            for user in users
+            for _ in range(options['experiments_per_user'])
+        )
+
+        # Measured on the first user and its first experiment, which grow like all the others
+        user, experiment = users[0], experiments[0]
+        seeded = 0
+        for target in sorted(options['steps']):
+            seeded += self._seed(experiments, seeded, target - seeded)
+            connection.cursor().execute('ANALYZE')
+            timings = self._measure(user, experiment, options['repeat'])
+            self.stdout.write(f'analyses={seeded} ' + ' '.join(
+                f'{name}={median * 1000:.2f}ms' for name, median in timings.items()
+            ))
+
+        if options['explain']:
+            for name, queryset in self._queries(user, experiment).items():
+                self.stdout.write(f'-- {name}\n{queryset.explain()}')
+
+    def _seed(self, experiments, offset, count):
+        # 1 in 100 analyses is still queued or running, as in production
+        for start in range(0, count, BATCH_SIZE):
+            analyses = Analysis.objects.bulk_create(
+                Analysis(
+                    title='benchmark',
+                    type=AnalysisTypeChoices.HOMOLOGY_SEARCH,
+                    status=AnalysisStatusChoices.WAITING if i % 100 == 0 else AnalysisStatusChoices.SUCCEEDED,
+                    experiment=experiments[i % len(experiments)],
+                    parameters={},
+                )
+                for i in range(offset + start, offset + min(start + BATCH_SIZE, count))
+            )
+            inputs = AnalysisInput.objects.bulk_create(
+                AnalysisInput(command='benchmark', analysis=analysis) for analysis in analyses
+            )
+            AnalysisOutput.objects.bulk_create(
+                AnalysisOutput(results={}, results_size=2, input=analysis_input) for analysis_input in inputs
+            )
+        return count
+
+    def _queries(self, user, experiment):
+        # Mirror ExperimentViewSet, AnalysisViewSet and TaxonomyTreeStrategy
+        analyses = Analysis.objects.filter(experiment__id=experiment.id, experiment__user=user)
+        parent = analyses.order_by('id').first()
+        return {
+            'experiment_list': Experiment.objects.filter(user=user).order_by('-id')[:15],
+            'analysis_list': (
+                analyses.defer('parameters')
+                .annotate(results_size=Sum('inputs__outputs__results_size'))
+                .order_by('-id')[:15]
+            ),
+            'analysis_count': analyses.values('id'),
+            'parent_output': AnalysisOutput.objects.filter(input__analysis_id=parent.id).order_by('-id')[:1],
+            'active_analyses': Analysis.objects.filter(
+                status__in=[AnalysisStatusChoices.WAITING, AnalysisStatusChoices.STARTED],
+            ).order_by('id')[:100],
+        }
+
+    def _measure(self, user, experiment, repeat):
+        timings = {}
+        for name, queryset in self._queries(user, experiment).items():
+            runs = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                if name == 'analysis_count':
+                    queryset.count()
+                else:
+                    list(queryset.all())
+                runs.append(time.perf_counter() - start)
+            timings[name] = statistics.median(runs)
+        return timings
@@ -7,49 +7,37 @@ import time
 from psycopg2 import OperationalError as Psycopg2OpError
 
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 import pika
 
+from core.constants import RABBITMQ_QUEUE_PREFIXES, RABBITMQ_QUEUE_SETTINGS
+from core.rabbitmq_connection import get_connection_parameters
+
 class Command(BaseCommand):
     """Django command to wait for database."""
 
     def handle(self, *args, **options):
         """Entrypoint for command."""
-        self.stdout.write('Creating blastn exchange and queue...')
+        # Without them every queued analysis would fail when its outbox message is saved
+        missing = [
+            f'{prefix}_{setting}'
+            for prefix in RABBITMQ_QUEUE_PREFIXES
+            for setting in RABBITMQ_QUEUE_SETTINGS
+            if not os.environ.get(f'{prefix}_{setting}')
+        ]
+        if missing:
+            raise CommandError(f"RabbitMQ is not configured, missing: {', '.join(missing)}")
+
+        self.stdout.write('Creating blastn, taxonomy tree and pairwise batch exchanges and queues...')
         exchange_up = False
         while exchange_up is False:
             try:
-                connection_parameters = pika.ConnectionParameters(
-                    host='rabbitmq',
-                    port=5672,
-                    credentials=pika.PlainCredentials(
-                        username=os.environ.get('RABBITMQ_DEFAULT_USER'),
-                        password=os.environ.get('RABBITMQ_DEFAULT_PASS')
-                    )
-                )
-                connection = pika.BlockingConnection(connection_parameters)
+                connection = pika.BlockingConnection(get_connection_parameters())
                 channel = connection.channel()
 
-                # Declare the exchange
-                channel.exchange_declare(
-                    exchange=os.environ.get('RABBITMQ_BLASTN_EXCHANGE_NAME'),
-                    exchange_type=os.environ.get('RABBITMQ_BLASTN_EXCHANGE_TYPE'),
-                    durable=bool(os.environ.get('RABBITMQ_BLASTN_EXCHANGE_DURABLE'))
-                )
-
-                # Declare the queue
-                channel.queue_declare(
-                    queue=os.environ.get('RABBITMQ_BLASTN_QUEUE_NAME'),
-                    durable=True
-                )
-
-                # Bind the queue to the exchange
-                channel.queue_bind(
-                    exchange=os.environ.get('RABBITMQ_BLASTN_EXCHANGE_NAME'),
-                    queue=os.environ.get('RABBITMQ_BLASTN_QUEUE_NAME'),
-                    routing_key=os.environ.get('RABBITMQ_BLASTN_ROUTING_KEY')
-                )
+                for prefix in RABBITMQ_QUEUE_PREFIXES:
+                    self._declare(channel, prefix)
 
                 connection.close()
                 exchange_up = True
@@ -57,4 +45,26 @@ class Command(BaseCommand):
                 self.stdout.write('RabbitMQ unavailable, waiting 1 second...')
                 time.sleep(1)
 
-        self.stdout.write(self.style.SUCCESS('RabbitMQ exchange and queue are available!'))
+        self.stdout.write(self.style.SUCCESS('RabbitMQ exchanges and queues are available!'))
+
+    def _declare(self, channel, prefix):
+        """Declare the exchange and queue configured by the env vars with the given prefix."""
+        # Declare the exchange
+        channel.exchange_declare(
+            exchange=os.environ.get(f'{prefix}_EXCHANGE_NAME'),
+            exchange_type=os.environ.get(f'{prefix}_EXCHANGE_TYPE'),
+            durable=bool(os.environ.get(f'{prefix}_EXCHANGE_DURABLE'))
+        )
+
+        # Declare the queue
+        channel.queue_declare(
+            queue=os.environ.get(f'{prefix}_QUEUE_NAME'),
+            durable=True
+        )
+
+        # Bind the queue to the exchange
+        channel.queue_bind(
+            exchange=os.environ.get(f'{prefix}_EXCHANGE_NAME'),
+            queue=os.environ.get(f'{prefix}_QUEUE_NAME'),
+            routing_key=os.environ.get(f'{prefix}_ROUTING_KEY')
+        )
@@ -0,0 +1,41 @@
+"""
+Django command to fail analyses whose worker died.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.constants import ANALYSIS_STALE_SECONDS
+from core.execution import reap_stale_analyses
+
+
+class Command(BaseCommand):
+    """Django command to move STARTED analyses without a recent heartbeat to FAILED."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-after',
+            type=float,
+            default=ANALYSIS_STALE_SECONDS,
+            help='Seconds without a heartbeat after which a STARTED analysis is failed.',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60,
+            help='Seconds between sweeps.',
+        )
+        parser.add_argument('--once', action='store_true', help='Sweep once and exit.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        self.stdout.write(self.style.SUCCESS('Reaping stale analyses...'))
+        while True:
+            close_old_connections()
+            reaped = reap_stale_analyses(options['stale_after'])
+            if reaped:
+                self.stdout.write(f'Failed {reaped} stale analyses')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
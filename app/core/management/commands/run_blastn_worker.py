@@ -0,0 +1,89 @@
+"""
+Django command to run the blastn worker.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from core.blastn import run_blastn
+from core.constants import BLASTN_QUEUE
+from core.execution import start_analysis, finish_analysis, fail_analysis, heartbeat
+from core.models import Analysis
+from core.rabbitmq_consumer import RabbitmqConsumer
+from core.tool_runner import ToolCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Django command to consume homology searches and run them with blastn."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=1,
+            help='Value passed to blastn -num_threads for each job.',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Number of concurrent blastn jobs. Defaults to CPU count divided by --threads.',
+        )
+        parser.add_argument(
+            '--prefetch',
+            type=int,
+            default=None,
+            help='Number of unacknowledged messages the worker may hold. Defaults to --processes.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        threads = max(1, options['threads'])
+        processes = options['processes'] or max(1, (os.cpu_count() or 1) // threads)
+        prefetch = options['prefetch'] or processes
+
+        # The pool forks all its processes on the first submit. Make that happen now,
+        # before a job opens a database connection or starts the heartbeat thread, so
+        # that no process inherits a live socket or forks while another thread runs.
+        connections.close_all()
+        executor = ProcessPoolExecutor(max_workers=processes)
+        executor.submit(os.getpid).result()
+        consumer = RabbitmqConsumer(queue=BLASTN_QUEUE, prefetch_count=prefetch)
+
+        def submit(body, redelivered):
+            analysis = start_analysis(body['analysis_id'], redelivered)
+            if analysis is None:
+                return None
+            # Beats from this process: the pool processes stay off the database
+            heartbeat.add(analysis.id)
+            return executor.submit(run_blastn, analysis.id, body['parameters'], threads)
+
+        def on_done(body, future):
+            # Runs on the executor's thread, also after the broker connection was lost
+            heartbeat.discard(body['analysis_id'])
+            close_old_connections()
+            analysis = Analysis.objects.get(pk=body['analysis_id'])
+            try:
+                execution = future.result()
+            except ToolCancelled:
+                logger.info("Analysis %s cancelled", analysis.id)
+                return
+            except Exception:
+                logger.exception("Analysis %s failed", analysis.id)
+                fail_analysis(analysis)
+                return
+            finish_analysis(analysis, execution)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Consuming homology searches from {BLASTN_QUEUE} '
+            f'with {processes} processes x {threads} threads (prefetch {prefetch})...'
+        ))
+        try:
+            consumer.consume_async(submit, on_done)
+        finally:
+            executor.shutdown(wait=True)
@@ -0,0 +1,37 @@
+"""
+Django command to relay outbox messages to RabbitMQ.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.outbox import relay_pending_messages
+
+
+class Command(BaseCommand):
+    """Django command to publish committed outbox messages in batches."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Maximum number of messages published per relay transaction.',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0.5,
+            help='Seconds to wait before polling again when the outbox is empty.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        self.stdout.write(self.style.SUCCESS('Relaying outbox messages...'))
+        while True:
+            close_old_connections()
+            relayed = relay_pending_messages(options['batch_size'])
+            # A full batch means there may be more waiting; poll again right away
+            if relayed < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+"""
+Django command to run the pairwise batch worker.
+"""
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.constants import PAIRWISE_BATCH_PROCESSES, PAIRWISE_BATCH_QUEUE
+from core.execution import run_async_analysis
+from core.rabbitmq_consumer import RabbitmqConsumer
+from core.strategies import PairwiseBatchStrategy
+
+
+class Command(BaseCommand):
+    """Django command to consume batch pairwise analyses and score them."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=PAIRWISE_BATCH_PROCESSES,
+            help='Processes scoring the rows of each batch.',
+        )
+        parser.add_argument(
+            '--prefetch',
+            type=int,
+            default=1,
+            help='Number of unacknowledged messages the worker may hold.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        strategy = PairwiseBatchStrategy()
+        consumer = RabbitmqConsumer(queue=PAIRWISE_BATCH_QUEUE, prefetch_count=options['prefetch'])
+
+        def perform(analysis):
+            # Each batch forks its scoring pool: it must not inherit the database connection
+            connections.close_all()
+            return strategy.run_batch(analysis, processes=options['processes'])
+
+        def on_message(body, redelivered):
+            run_async_analysis(body['analysis_id'], perform, redelivered)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Consuming batch pairwise analyses from {PAIRWISE_BATCH_QUEUE} with {options['processes']} processes..."
+        ))
+        consumer.consume(on_message)
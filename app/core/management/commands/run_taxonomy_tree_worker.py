@@ -0,0 +1,36 @@
+"""
+Django command to run the taxonomy tree worker.
+"""
+from django.core.management.base import BaseCommand
+
+from core.constants import TAXONOMY_TREE_QUEUE
+from core.execution import cancellation_check, run_async_analysis
+from core.rabbitmq_consumer import RabbitmqConsumer
+from core.strategies import TaxonomyTreeStrategy
+from core.tool_runner import ToolRunner
+
+
+class Command(BaseCommand):
+    """Django command to consume taxonomy tree analyses and build their trees."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefetch',
+            type=int,
+            default=1,
+            help='Number of unacknowledged messages the worker may hold.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        strategy = TaxonomyTreeStrategy()
+        consumer = RabbitmqConsumer(queue=TAXONOMY_TREE_QUEUE, prefetch_count=options['prefetch'])
+
+        def perform(analysis):
+            return strategy.run_pipeline(analysis, ToolRunner(should_cancel=cancellation_check(analysis.id)))
+
+        def on_message(body, redelivered):
+            run_async_analysis(body['analysis_id'], perform, redelivered)
+
+        self.stdout.write(self.style.SUCCESS(f'Consuming taxonomy tree analyses from {TAXONOMY_TREE_QUEUE}...'))
+        consumer.consume(on_message)
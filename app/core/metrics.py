@@ -0,0 +1,61 @@
+# core/metrics.py
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import List
+
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from .constants import METRICS_WINDOW_SECONDS
+from .models import AnalysisStageTiming
+from .strategies import get_pairwise_cache_stats
+
+METRICS_PREFIX = 'olatcg'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (metric suffix, aggregated column, aggregate, help). Stages are aggregated over a
+# sliding window, so every stage metric is a gauge.
+STAGE_METRICS = [
+    ('analysis_stage_runs', 'id', Count, 'Analysis stages recorded in the window.'),
+    ('analysis_stage_wall_seconds', 'wall_seconds', Sum, 'Wall time spent in the stage in the window.'),
+    ('analysis_stage_cpu_seconds', 'cpu_seconds', Sum, 'CPU time spent in the stage in the window, including child processes.'),
+    ('analysis_stage_wall_seconds_max', 'wall_seconds', Max, 'Slowest run of the stage in the window.'),
+    ('analysis_stage_peak_rss_kilobytes', 'peak_rss_kb', Max, 'Highest peak RSS of the stage in the window.'),
+    ('analysis_stage_input_bytes', 'bytes_in', Sum, 'Bytes read by the stage in the window.'),
+    ('analysis_stage_output_bytes', 'bytes_out', Sum, 'Bytes written by the stage in the window.'),
+]
+
+
+def render_metrics(window_seconds: int = METRICS_WINDOW_SECONDS) -> str:
+    """
+    Render the stage timings of the last window_seconds per analysis type and stage
+    in the Prometheus text format.
+    """
+    since = timezone.now() - timedelta(seconds=window_seconds)
+    rows = list(
+        AnalysisStageTiming.objects
+        .filter(created_at__gte=since)
+        .values('analysis__type', 'stage')
+        .annotate(**{name: aggregate(column) for name, column, aggregate, _ in STAGE_METRICS})
+        .order_by('analysis__type', 'stage')
+    )
+
+    lines: List[str] = []
+    for name, _column, _aggregate, help_text in STAGE_METRICS:
+        lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} gauge")
+        for row in rows:
+            labels = f'type="{_escape(row["analysis__type"])}",stage="{_escape(row["stage"])}"'
+            lines.append(f"{METRICS_PREFIX}_{name}{{{labels}}} {row[name] or 0}")
+
+    name = f"{METRICS_PREFIX}_pairwise_cache_requests_total"
+    lines.append(f"# HELP {name} Pairwise alignment cache lookups.")
+    lines.append(f"# TYPE {name} counter")
+    for outcome, value in get_pairwise_cache_stats().items():
+        lines.append(f'{name}{{outcome="{outcome}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
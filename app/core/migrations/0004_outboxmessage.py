@@ -0,0 +1,27 @@
+# Generated by Django 4.2.19 on 2026-10-17 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_analysisoutput_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('exchange', models.CharField(max_length=255)),
+                ('routing_key', models.CharField(max_length=255)),
+                ('body', models.JSONField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
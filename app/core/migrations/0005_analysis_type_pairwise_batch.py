@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-17 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysis',
+            name='type',
+            field=models.CharField(choices=[('PAIRWISE_ALIGNMENT', 'Pairwise Alignment'), ('HOMOLOGY_SEARCH', 'Homology Search'), ('TAXONOMY_TREE', 'Taxonomy Tree'), ('PAIRWISE_BATCH', 'Batch Pairwise Alignment')], max_length=18),
+        ),
+    ]
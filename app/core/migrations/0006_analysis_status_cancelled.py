@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-17 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_analysis_type_pairwise_batch'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysis',
+            name='status',
+            field=models.CharField(blank=True, choices=[('WAITING', 'Waiting'), ('STARTED', 'Started'), ('FAILED', 'Failled'), ('SUCCEEDED', 'Succeeded'), ('CANCELLED', 'Cancelled')], default='WAITING', max_length=9),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.19 on 2026-10-17 16:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_analysis_status_cancelled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisStageTiming',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('stage', models.CharField(max_length=50)),
+                ('wall_seconds', models.FloatField()),
+                ('cpu_seconds', models.FloatField()),
+                ('peak_rss_kb', models.BigIntegerField()),
+                ('bytes_in', models.BigIntegerField(null=True)),
+                ('bytes_out', models.BigIntegerField(null=True)),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stage_timings', to='core.analysis')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
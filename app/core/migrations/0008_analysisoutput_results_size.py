@@ -0,0 +1,25 @@
+# Generated by Django 4.2.19 on 2026-10-17 16:20
+
+from django.db import migrations, models
+from django.db.models.functions import Cast, Length
+
+
+def backfill_results_size(apps, schema_editor):
+    AnalysisOutput = apps.get_model('core', 'AnalysisOutput')
+    AnalysisOutput.objects.update(results_size=Length(Cast('results', output_field=models.TextField())))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_analysisstagetiming'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisoutput',
+            name='results_size',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(backfill_results_size, migrations.RunPython.noop),
+    ]
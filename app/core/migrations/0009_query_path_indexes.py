@@ -0,0 +1,53 @@
+# Generated by Django 4.2.19 on 2026-10-17 16:40
+
+from django.db import migrations, models
+
+
+def create_index_concurrently(model_name, index, table, definition):
+    """
+    AddIndex in the migration state; in the database CREATE INDEX CONCURRENTLY IF NOT
+    EXISTS, so that a run interrupted after some indexes were built can be repeated.
+    """
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[
+            migrations.RunSQL(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index.name}" ON "{table}" {definition}',
+                reverse_sql=f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"',
+            ),
+        ],
+        state_operations=[
+            migrations.AddIndex(model_name=model_name, index=index),
+        ],
+    )
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, and keeps the tables writable
+    atomic = False
+
+    dependencies = [
+        ('core', '0008_analysisoutput_results_size'),
+    ]
+
+    operations = [
+        create_index_concurrently(
+            'experiment',
+            models.Index(fields=['user', '-id'], name='experiment_user_id_idx'),
+            'core_experiment', '("user_id", "id" DESC)',
+        ),
+        create_index_concurrently(
+            'analysis',
+            models.Index(fields=['experiment', '-id'], name='analysis_experiment_id_idx'),
+            'core_analysis', '("experiment_id", "id" DESC)',
+        ),
+        create_index_concurrently(
+            'analysis',
+            models.Index(condition=models.Q(('status__in', ['WAITING', 'STARTED'])), fields=['status', 'id'], name='analysis_active_status_idx'),
+            'core_analysis', '("status", "id") WHERE "status" IN (\'WAITING\', \'STARTED\')',
+        ),
+        create_index_concurrently(
+            'analysisoutput',
+            models.Index(fields=['input', '-id'], name='analysisoutput_input_id_idx'),
+            'core_analysisoutput', '("input_id", "id" DESC)',
+        ),
+    ]
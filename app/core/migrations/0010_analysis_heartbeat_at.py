@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-17 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_query_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='heartbeat_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
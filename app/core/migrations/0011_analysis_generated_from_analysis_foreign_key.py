@@ -0,0 +1,19 @@
+# Generated by Django 4.2.19 on 2026-10-17 17:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_analysis_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysis',
+            name='generated_from_analysis',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generated_analyses', to='core.analysis'),
+        ),
+    ]
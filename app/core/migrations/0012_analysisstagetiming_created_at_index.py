@@ -0,0 +1,17 @@
+# Generated by Django 4.2.19 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_analysis_generated_from_analysis_foreign_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analysisstagetiming',
+            index=models.Index(fields=['created_at'], name='stagetiming_created_at_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.19 on 2026-10-17 18:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def drop_index_concurrently(model_name, name, field, index, table, column):
+    """
+    AlterField(db_index=False) in the migration state; in the database DROP INDEX
+    CONCURRENTLY IF EXISTS on the index Django named for the foreign key.
+    """
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[
+            migrations.RunSQL(
+                f'DROP INDEX CONCURRENTLY IF EXISTS "{index}"',
+                reverse_sql=f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index}" ON "{table}" ("{column}")',
+            ),
+        ],
+        state_operations=[
+            migrations.AlterField(model_name=model_name, name=name, field=field),
+        ],
+    )
+
+
+class Migration(migrations.Migration):
+    # The composite indexes of 0009 lead with the foreign key, so its own index is
+    # redundant. Dropped apart from 0009 so that each step can be retried on its own.
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0012_analysisstagetiming_created_at_index'),
+    ]
+
+    operations = [
+        drop_index_concurrently(
+            'experiment', 'user',
+            models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='experiments', to=settings.AUTH_USER_MODEL),
+            'core_experiment_user_id_df4f9593', 'core_experiment', 'user_id',
+        ),
+        drop_index_concurrently(
+            'analysis', 'experiment',
+            models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='analyses', to='core.experiment'),
+            'core_analysis_experiment_id_d4d4c2c5', 'core_analysis', 'experiment_id',
+        ),
+        drop_index_concurrently(
+            'analysisoutput', 'input',
+            models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='outputs', to='core.analysisinput'),
+            'core_analysisoutput_input_id_2d3e91ee', 'core_analysisoutput', 'input_id',
+        ),
+    ]
@@ -9,21 +9,37 @@ class TimestampedModel(models.Model):
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        # auto_now only applies to saved fields, and updated_at versions cached responses
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+        super().save(*args, **kwargs)
+
 class Experiment(TimestampedModel):
     title = models.CharField(max_length=255, null=False)
     description = models.CharField(max_length=500, default=None)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='experiments')
+    # Covered by experiment_user_id_idx
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='experiments', db_index=False)
+
+    class Meta:
+        indexes = [
+            # Experiment list: filter by user, newest first
+            models.Index(fields=['user', '-id'], name='experiment_user_id_idx'),
+        ]
 
 class AnalysisTypeChoices(models.TextChoices):
     PAIRWISE_ALIGNMENT = 'PAIRWISE_ALIGNMENT', _('Pairwise Alignment')
     HOMOLOGY_SEARCH = 'HOMOLOGY_SEARCH', _('Homology Search')
     TAXONOMY_TREE = 'TAXONOMY_TREE', _('Taxonomy Tree')
+    PAIRWISE_BATCH = 'PAIRWISE_BATCH', _('Batch Pairwise Alignment')
 
 class AnalysisStatusChoices(models.TextChoices):
     WAITING = 'WAITING', _('Waiting')
     STARTED = 'STARTED', _('Started')
     FAILED = 'FAILED', _('Failled')
     SUCCEEDED = 'SUCCEEDED', _('Succeeded')
+    CANCELLED = 'CANCELLED', _('Cancelled')
 
 class Analysis(TimestampedModel):
     title = models.CharField(max_length=255, null=False, blank=False)
@@ -38,20 +54,37 @@ class Analysis(TimestampedModel):
         default=AnalysisStatusChoices.WAITING,
         blank=True
     )
-    generated_from_analysis = models.OneToOneField(
+    # Several trees can be built from the same homology search
+    generated_from_analysis = models.ForeignKey(
         'self',
         on_delete=models.SET_NULL,
-        related_name='generated_analysis',
+        related_name='generated_analyses',
         null=True,
         default=None
     )
+    # Covered by analysis_experiment_id_idx
     experiment = models.ForeignKey(
         Experiment,
         on_delete=models.CASCADE,
         related_name='analyses',
-        null=False
+        null=False,
+        db_index=False
     )
     parameters = models.JSONField(null=False, blank=False)
+    # Refreshed by the worker running the analysis; see reap_stale_analyses
+    heartbeat_at = models.DateTimeField(null=True, default=None)
+
+    class Meta:
+        indexes = [
+            # Analysis list: filter by experiment, newest first
+            models.Index(fields=['experiment', '-id'], name='analysis_experiment_id_idx'),
+            # Queued and running analyses are few next to finished ones
+            models.Index(
+                fields=['status', 'id'],
+                name='analysis_active_status_idx',
+                condition=models.Q(status__in=[AnalysisStatusChoices.WAITING, AnalysisStatusChoices.STARTED]),
+            ),
+        ]
 
 class AnalysisInput(TimestampedModel):
     command = models.CharField(max_length=5000, null=True)
@@ -64,10 +97,45 @@ class AnalysisInput(TimestampedModel):
 
 class AnalysisOutput(TimestampedModel):
     results = models.JSONField(null=True)
+    # Serialized size of results, so listings can report it without loading them
+    results_size = models.BigIntegerField(null=True)
     file = models.CharField(max_length=1000, null=True)
+    # Covered by analysisoutput_input_id_idx
     input = models.ForeignKey(
         AnalysisInput,
         on_delete=models.CASCADE,
         related_name='outputs',
+        null=False,
+        db_index=False
+    )
+
+    class Meta:
+        indexes = [
+            # Outputs of an analysis by id, e.g. the latest one of a parent analysis
+            models.Index(fields=['input', '-id'], name='analysisoutput_input_id_idx'),
+        ]
+
+class AnalysisStageTiming(TimestampedModel):
+    analysis = models.ForeignKey(
+        Analysis,
+        on_delete=models.CASCADE,
+        related_name='stage_timings',
         null=False
     )
+    stage = models.CharField(max_length=50, null=False)
+    wall_seconds = models.FloatField(null=False)
+    cpu_seconds = models.FloatField(null=False)
+    peak_rss_kb = models.BigIntegerField(null=False)
+    bytes_in = models.BigIntegerField(null=True)
+    bytes_out = models.BigIntegerField(null=True)
+
+    class Meta:
+        # The metrics endpoint aggregates a recent window
+        indexes = [
+            models.Index(fields=['created_at'], name='stagetiming_created_at_idx'),
+        ]
+
+class OutboxMessage(TimestampedModel):
+    exchange = models.CharField(max_length=255)
+    routing_key = models.CharField(max_length=255)
+    body = models.JSONField(null=False)
@@ -0,0 +1,80 @@
+import json
+import logging
+import time
+from typing import AsyncIterator
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .constants import ANALYSIS_EVENTS_HEARTBEAT_SECONDS, ANALYSIS_EVENTS_MAX_SECONDS, ANALYSIS_EVENTS_RETRY_SECONDS
+from .models import Analysis, AnalysisStatusChoices
+
+logger = logging.getLogger(__name__)
+
+STATUS_CHANNEL_PREFIX = 'analysis_status'
+FINAL_STATUSES = {
+    AnalysisStatusChoices.SUCCEEDED,
+    AnalysisStatusChoices.FAILED,
+    AnalysisStatusChoices.CANCELLED,
+}
+
+
+def _status_channel(analysis_id: int) -> str:
+    return f"{STATUS_CHANNEL_PREFIX}:{analysis_id}"
+
+
+def _status_event(analysis_id: int, status: str) -> dict:
+    return {'id': analysis_id, 'status': status}
+
+
+def publish_status(analysis_id: int, status: str) -> None:
+    """Publish a status change. Like the cache, notifications are best-effort."""
+    try:
+        get_redis_connection('default').publish(
+            _status_channel(analysis_id), json.dumps(_status_event(analysis_id, status)),
+        )
+    except Exception:
+        logger.warning("Could not publish status %s of analysis %s", status, analysis_id, exc_info=True)
+
+
+async def status_events(analysis_id: int) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for one analysis: its current status, then every change
+    until a final status. Comment lines keep idle connections open through proxies.
+
+    Django 4.2 does not notice a client disconnecting from a streaming response, so
+    a stream that nobody reads would otherwise live until the final status. Each
+    stream therefore ends after ANALYSIS_EVENTS_MAX_SECONDS; the retry field makes
+    EventSource reconnect, and the new stream starts with the current status.
+    """
+    deadline = time.monotonic() + ANALYSIS_EVENTS_MAX_SECONDS
+    client = aioredis.from_url(settings.CACHES['default']['LOCATION'])
+    pubsub = client.pubsub()
+    try:
+        # Subscribe before reading the row so that no change can fall in between
+        await pubsub.subscribe(_status_channel(analysis_id))
+        status = await Analysis.objects.filter(pk=analysis_id).values_list('status', flat=True).afirst()
+        yield f"retry: {int(ANALYSIS_EVENTS_RETRY_SECONDS * 1000)}\n\n"
+        yield _format_event(_status_event(analysis_id, status))
+
+        while status is not None and status not in FINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=min(ANALYSIS_EVENTS_HEARTBEAT_SECONDS, remaining),
+            )
+            if message is None:
+                yield ': heartbeat\n\n'
+                continue
+            event = json.loads(message['data'])
+            status = event['status']
+            yield _format_event(event)
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
+
+
+def _format_event(event: dict) -> str:
+    return f"event: status\ndata: {json.dumps(event)}\n\n"
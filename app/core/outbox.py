@@ -0,0 +1,46 @@
+import logging
+from itertools import groupby
+from typing import Dict
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .models import OutboxMessage
+from .rabbitmq_producer import RabbitmqPublisher
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_message(exchange: str, routing_key: str, body: Dict) -> OutboxMessage:
+    """
+    Record a message to be published. Call it inside the transaction that creates the
+    analysis: the message only becomes visible to the relay if that transaction commits.
+    """
+    if not exchange or not routing_key:
+        raise ImproperlyConfigured("RabbitMQ exchange and routing key must be set, see initialize_rabbitmq")
+    return OutboxMessage.objects.create(exchange=exchange, routing_key=routing_key, body=body)
+
+
+def relay_pending_messages(batch_size: int = 100) -> int:
+    """Publish up to batch_size pending messages and delete them. Returns how many were relayed."""
+    with transaction.atomic():
+        # skip_locked lets several relays drain the outbox without publishing twice
+        messages = list(
+            OutboxMessage.objects
+            .select_for_update(skip_locked=True)
+            .order_by('id')[:batch_size]
+        )
+        if not messages:
+            return 0
+
+        def destination(message):
+            return message.exchange, message.routing_key
+
+        for (exchange, routing_key), group in groupby(sorted(messages, key=destination), key=destination):
+            publisher = RabbitmqPublisher(exchange=exchange, routing_key=routing_key)
+            publisher.send_messages([message.body for message in group])
+
+        OutboxMessage.objects.filter(id__in=[message.id for message in messages]).delete()
+
+    logger.info("Relayed %d outbox messages", len(messages))
+    return len(messages)
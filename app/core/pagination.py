@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination
+
+from .constants import API_MAX_PAGE_SIZE
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination: each page is an index range scan from the cursor, with no
+    COUNT(*) or OFFSET, so deep pages cost the same as the first one.
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = API_MAX_PAGE_SIZE
+
+
+class OutputCursorPagination(IdCursorPagination):
+    # Outputs are listed in creation order, unlike experiments and analyses
+    ordering = 'id'
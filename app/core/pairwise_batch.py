@@ -0,0 +1,82 @@
+# core/pairwise_batch.py
+"""
+Score matrices for PAIRWISE_BATCH analyses. Kept free of Django imports because the
+row functions run inside worker processes.
+"""
+from __future__ import annotations
+
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple
+
+from Bio.Align import PairwiseAligner
+
+# Below this many pairs forking a pool costs more than it saves
+PARALLEL_MIN_PAIRS = 2000
+
+_aligner: Optional[PairwiseAligner] = None
+_targets: List[str] = []
+
+
+class ScoreMatrix(NamedTuple):
+    scores: List[List[float]]
+    # Highest peak RSS of the pool processes; 0 when the rows were scored in-process
+    pool_peak_rss_kb: int
+
+
+def score_matrix(parameters: dict, queries: List[str], targets: Optional[List[str]] = None,
+                 processes: Optional[int] = None) -> ScoreMatrix:
+    """
+    Score every query against every target. When targets is None the queries are
+    compared against each other and only the upper triangle is computed.
+    """
+    pool_peak_rss_kb = 0
+    symmetric = targets is None
+    targets = queries if symmetric else targets
+    rows = [(i, i if symmetric else 0) for i in range(len(queries))]
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(queries) * len(targets) < PARALLEL_MIN_PAIRS:
+        _init_worker(parameters, targets)
+        partial_rows = [_score_row(queries[i], start)[0] for i, start in rows]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(parameters, targets),
+        ) as executor:
+            results = list(executor.map(
+                _score_row,
+                [queries[i] for i, _ in rows],
+                [start for _, start in rows],
+                chunksize=max(1, len(rows) // (processes * 4)),
+            ))
+        partial_rows = [scores for scores, _ in results]
+        pool_peak_rss_kb = max(peak for _, peak in results)
+
+    matrix = [[0.0] * len(targets) for _ in queries]
+    for (i, start), scores in zip(rows, partial_rows):
+        for j, score in enumerate(scores, start=start):
+            matrix[i][j] = score
+            if symmetric:
+                matrix[j][i] = score
+    return ScoreMatrix(matrix, pool_peak_rss_kb)
+
+
+def _init_worker(parameters: dict, targets: List[str]) -> None:
+    # One configured aligner (and one copy of the targets) per process, reused for every row
+    global _aligner, _targets
+    _aligner = PairwiseAligner()
+    _aligner.mode = parameters['mode']
+    _aligner.match_score = parameters['match_score']
+    _aligner.mismatch_score = parameters['mismatch_score']
+    _aligner.open_gap_score = parameters['open_gap_score']
+    _aligner.extend_gap_score = parameters['extend_gap_score']
+    _targets = targets
+
+
+def _score_row(query: str, start: int) -> Tuple[List[float], int]:
+    # A forked process starts its peak RSS afresh, so this is the pool process' own peak
+    scores = [_aligner.score(query, target) for target in _targets[start:]]
+    return scores, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,23 @@
+import ipaddress
+import secrets
+
+from rest_framework.permissions import BasePermission
+
+from .constants import METRICS_ALLOWED_NETWORKS, METRICS_TOKEN
+
+
+class IsMetricsScraper(BasePermission):
+    """
+    Lets in scrapers that present METRICS_TOKEN as a bearer token or, when no token
+    is configured, that connect from one of METRICS_ALLOWED_NETWORKS.
+    """
+
+    def has_permission(self, request, view):
+        if METRICS_TOKEN:
+            scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+            return scheme.lower() == 'bearer' and secrets.compare_digest(token.encode(), METRICS_TOKEN.encode())
+        try:
+            address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+        except ValueError:
+            return False
+        return any(address in ipaddress.ip_network(network) for network in METRICS_ALLOWED_NETWORKS)
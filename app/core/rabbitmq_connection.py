@@ -0,0 +1,18 @@
+import pika
+from .constants import (
+    RABBITMQ_HOST,
+    RABBITMQ_PORT,
+    RABBITMQ_DEFAULT_USER,
+    RABBITMQ_DEFAULT_PASS,
+)
+
+
+def get_connection_parameters() -> pika.ConnectionParameters:
+    return pika.ConnectionParameters(
+        host=RABBITMQ_HOST,
+        port=RABBITMQ_PORT,
+        credentials=pika.PlainCredentials(
+            username=RABBITMQ_DEFAULT_USER,
+            password=RABBITMQ_DEFAULT_PASS
+        )
+    )
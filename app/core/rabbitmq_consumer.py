@@ -0,0 +1,119 @@
+import json
+import logging
+import time
+from concurrent.futures import Future
+from functools import partial
+from typing import Callable, Dict, Optional
+
+import pika
+from pika.exceptions import AMQPChannelError, AMQPConnectionError, ConnectionWrongStateError
+
+from .constants import RABBITMQ_RECONNECT_MAX_SECONDS, RABBITMQ_RECONNECT_SECONDS
+from .rabbitmq_connection import get_connection_parameters
+
+logger = logging.getLogger(__name__)
+
+
+class RabbitmqConsumer:
+    def __init__(
+        self,
+        queue,
+        prefetch_count: int = 1,
+        connection_parameters: Optional[pika.ConnectionParameters] = None,
+        connection_factory: Callable = pika.BlockingConnection,
+    ) -> None:
+        self.__queue = queue
+        self.__prefetch_count = prefetch_count
+        self.__connection_parameters = connection_parameters or get_connection_parameters()
+        # A stand-in broker can be injected for local testing
+        self.__connection_factory = connection_factory
+
+    def consume(self, callback: Callable[[Dict, bool], None]) -> None:
+        """
+        Process each message synchronously and ack it once callback returns. callback
+        also gets whether the broker redelivered the message.
+        """
+        def on_message(channel, method, properties, body):
+            try:
+                callback(json.loads(body), method.redelivered)
+            except Exception:
+                logger.exception("Failed to process message from queue %s", self.__queue)
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                return
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+
+        self.__start(on_message)
+
+    def consume_async(
+        self,
+        submit: Callable[[Dict, bool], Optional[Future]],
+        on_done: Callable[[Dict, Future], None],
+    ) -> None:
+        """
+        Hand each message to submit, with whether the broker redelivered it. submit may
+        schedule the message on an executor and return its future. on_done runs as the
+        future's done-callback, usually on an executor thread. It runs even if the
+        broker connection was lost meanwhile, so results are never lost with it.
+
+        Only the ack goes through the connection, once on_done has returned. If the
+        connection is gone by then, the broker redelivers the message, and submit
+        sees an analysis that has already finished. Messages for which submit returns
+        None are acked right away.
+        """
+        def settle(channel, delivery_tag, processed):
+            try:
+                if processed:
+                    channel.basic_ack(delivery_tag=delivery_tag)
+                else:
+                    channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+            except (AMQPConnectionError, AMQPChannelError):
+                logger.warning("Could not settle message from queue %s", self.__queue, exc_info=True)
+
+        def finish(channel, delivery_tag, body, future):
+            try:
+                on_done(body, future)
+                processed = True
+            except Exception:
+                logger.exception("Failed to finish message from queue %s", self.__queue)
+                processed = False
+            # pika channels may only be used from the connection's own thread
+            try:
+                channel.connection.add_callback_threadsafe(partial(settle, channel, delivery_tag, processed))
+            except ConnectionWrongStateError:
+                logger.warning("Connection to queue %s closed before message could be settled", self.__queue)
+
+        def on_message(channel, method, properties, raw):
+            try:
+                body = json.loads(raw)
+                future = submit(body, method.redelivered)
+            except Exception:
+                logger.exception("Failed to submit message from queue %s", self.__queue)
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                return
+            if future is None:
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            future.add_done_callback(partial(finish, channel, method.delivery_tag, body))
+
+        self.__start(on_message)
+
+    def __start(self, on_message) -> None:
+        """Consume until the channel stops, reconnecting with backoff when the broker goes away."""
+        delay = RABBITMQ_RECONNECT_SECONDS
+        while True:
+            connection = None
+            try:
+                connection = self.__connection_factory(self.__connection_parameters)
+                channel = connection.channel()
+                channel.basic_qos(prefetch_count=self.__prefetch_count)
+                channel.basic_consume(queue=self.__queue, on_message_callback=on_message)
+                delay = RABBITMQ_RECONNECT_SECONDS
+                channel.start_consuming()
+                return
+            except (AMQPConnectionError, AMQPChannelError):
+                logger.warning("Lost connection to queue %s, reconnecting in %ss", self.__queue, delay, exc_info=True)
+            finally:
+                if connection is not None and connection.is_open:
+                    connection.close()
+            time.sleep(delay)
+            delay = min(delay * 2, RABBITMQ_RECONNECT_MAX_SECONDS)
@@ -1,38 +1,93 @@
+import logging
 import os
-from typing import Dict
+import threading
+from typing import Dict, Iterable
 import pika
 import json
-from .constants import RABBITMQ_DEFAULT_USER, RABBITMQ_DEFAULT_PASS
+from .rabbitmq_connection import get_connection_parameters
+
+logger = logging.getLogger(__name__)
+
+RECOVERABLE_ERRORS = (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError)
+
+
+class _SharedConnection:
+    """
+    One AMQP connection per process, opened lazily and reopened after a fork or a
+    broker failure. Holds a channel in publisher confirm mode.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.__pid = None
+        self.__connection = None
+        self.__confirm_channel = None
+
+    def confirm_channel(self):
+        self.__ensure_connection()
+        if self.__confirm_channel is None or self.__confirm_channel.is_closed:
+            self.__confirm_channel = self.__connection.channel()
+            self.__confirm_channel.confirm_delivery()
+        return self.__confirm_channel
+
+    def reset(self) -> None:
+        # Never close a connection inherited from the parent process: the socket is shared
+        if self.__connection is not None and self.__pid == os.getpid():
+            try:
+                if self.__connection.is_open:
+                    self.__connection.close()
+            except Exception:
+                logger.debug("Ignoring error while closing RabbitMQ connection", exc_info=True)
+        self.__pid = None
+        self.__connection = None
+        self.__confirm_channel = None
+
+    def __ensure_connection(self) -> None:
+        if self.__pid != os.getpid() or self.__connection is None or self.__connection.is_closed:
+            self.reset()
+            self.__connection = pika.BlockingConnection(get_connection_parameters())
+            self.__pid = os.getpid()
+
+
+_shared_connection = _SharedConnection()
+
 
 class RabbitmqPublisher:
     def __init__(self, exchange, routing_key) -> None:
-        self.__host = "rabbitmq"
-        self.__port = 5672
-        self.__username = RABBITMQ_DEFAULT_USER
-        self.__password = RABBITMQ_DEFAULT_PASS
         self.__exchange = exchange
         self.__routing_key = routing_key
-        self.__channel = self.__create_channel()
-
-    def __create_channel(self):
-        connection_parameters = pika.ConnectionParameters(
-            host=self.__host,
-            port=self.__port,
-            credentials=pika.PlainCredentials(
-                username=self.__username,
-                password=self.__password
-            )
-        )
 
-        channel = pika.BlockingConnection(connection_parameters).channel()
-        return channel
+    def send_messages(self, bodies: Iterable[Dict]):
+        """
+        Publish messages on the confirm channel. Each publish returns once the broker
+        has confirmed it and raises if the broker nacks it, so the caller only forgets
+        messages the broker has taken responsibility for.
+        """
+        bodies = list(bodies)
+        if not bodies:
+            return
 
-    def send_message(self, body: Dict):
-        self.__channel.basic_publish(
+        def publish_batch():
+            channel = _shared_connection.confirm_channel()
+            for body in bodies:
+                self.__publish(channel, body)
+
+        with _shared_connection.lock:
+            self.__with_reconnect(publish_batch)
+
+    def __publish(self, channel, body: Dict):
+        channel.basic_publish(
             exchange=self.__exchange,
             routing_key=self.__routing_key,
             body=json.dumps(body),
             properties=pika.BasicProperties(
                 delivery_mode=2
             )
-        )
\ No newline at end of file
+        )
+
+    def __with_reconnect(self, publish):
+        try:
+            publish()
+        except RECOVERABLE_ERRORS:
+            logger.warning("RabbitMQ connection lost, reconnecting", exc_info=True)
+            _shared_connection.reset()
+            publish()
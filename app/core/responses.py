@@ -0,0 +1,88 @@
+# core/responses.py
+from __future__ import annotations
+
+import mimetypes
+import os
+import re
+from typing import Iterator, Optional, Tuple
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+STREAM_CHUNK_SIZE = 64 * 1024
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Analysis output files that mimetypes does not know about
+OUTPUT_CONTENT_TYPES = {
+    '.nwk': 'text/x-nh',
+    '.fasta': 'text/x-fasta',
+    '.tsv': 'text/tab-separated-values',
+}
+
+
+def ranged_file_response(request, path: str) -> HttpResponse:
+    """
+    Stream path without reading it into memory. A single 'Range: bytes=...' request
+    gets a 206 with that slice; anything else gets the whole file. Multiple ranges are
+    not supported and fall back to the whole file, which RFC 9110 allows.
+    """
+    size = os.path.getsize(path)
+    content_type, encoding = _content_type(path)
+    requested = _parse_range(request.headers.get('Range'), size)
+
+    if requested is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    elif requested is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    else:
+        start, end = requested
+        response = StreamingHttpResponse(_read_range(path, start, end), status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    if encoding and requested is not False:
+        # Served as stored: a gzip archive must not be transparently decoded by clients
+        response['Content-Type'] = 'application/gzip'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _parse_range(header: Optional[str], size: int):
+    """Return (start, end) inclusive, None to serve the whole file, or False if unsatisfiable."""
+    if not header:
+        return None
+    match = RANGE_HEADER.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    remaining = end - start + 1
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while remaining > 0:
+            chunk = fh.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _content_type(path: str) -> Tuple[str, Optional[str]]:
+    content_type, encoding = mimetypes.guess_type(path)
+    extension = os.path.splitext(path)[1]
+    return OUTPUT_CONTENT_TYPES.get(extension, content_type or 'application/octet-stream'), encoding
@@ -0,0 +1,55 @@
+# core/results.py
+from typing import Optional
+
+from django.db.models import Func, IntegerField, JSONField, QuerySet, Value
+
+from .models import AnalysisTypeChoices
+
+# Where the entries of each analysis type's results live, as a jsonpath. The results
+# list leaves out large results of these types; their entries are paged instead.
+RESULT_ENTRIES_PATHS = {
+    AnalysisTypeChoices.HOMOLOGY_SEARCH: '$',
+    AnalysisTypeChoices.PAIRWISE_ALIGNMENT: '$.alignments',
+    AnalysisTypeChoices.PAIRWISE_BATCH: '$.scores',
+}
+
+
+class _JsonPathFunc(Func):
+    # The path is sent as a plain string parameter; jsonb_path_* take a jsonpath
+    template = '%(function)s(%(expressions)s::jsonpath)'
+
+
+class JsonbPathQueryArray(_JsonPathFunc):
+    function = 'jsonb_path_query_array'
+    output_field = JSONField()
+
+
+class JsonbPathQueryFirst(_JsonPathFunc):
+    function = 'jsonb_path_query_first'
+    output_field = JSONField()
+
+
+class JsonbArrayLength(Func):
+    function = 'jsonb_array_length'
+    output_field = IntegerField()
+
+
+def page_result_entries(outputs: QuerySet, path: str, offset: int, limit: int) -> Optional[dict]:
+    """
+    Entries [offset, offset + limit) of the list at path in the results of the only
+    output in outputs. The slice is taken in the database, so only the page leaves it.
+    Returns None if there is no such output, or its results have no list at path.
+    """
+    page = (
+        outputs
+        .annotate(
+            total=JsonbArrayLength(JsonbPathQueryFirst('results', Value(path))),
+            # Lax mode: a range running past the end stops at the last entry
+            entries=JsonbPathQueryArray('results', Value(f'{path}[{offset} to {offset + limit - 1}]')),
+        )
+        .values('total', 'entries')
+        .first()
+    )
+    if page is None or page['total'] is None:
+        return None
+    return {'total': page['total'], 'offset': offset, 'limit': limit, 'entries': page['entries']}
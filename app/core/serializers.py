@@ -1,5 +1,6 @@
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Experiment, Analysis, AnalysisInput, AnalysisOutput
+from .models import Experiment, Analysis, AnalysisInput, AnalysisOutput, AnalysisStageTiming
 from django.contrib.auth.models import User
 
 class UserSerializer(serializers.ModelSerializer):
@@ -19,9 +20,46 @@ class ExperimentSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 class AnalysisOutputSerializer(serializers.ModelSerializer):
+    file_url = serializers.SerializerMethodField()
+
     class Meta:
         model = AnalysisOutput
-        fields = ['id', 'results', 'file']
+        fields = ['id', 'results', 'results_size', 'file', 'file_url']
+
+    def get_file_url(self, output):
+        # Taken from the URL being served so that no input/analysis lookup is needed per output
+        request = self.context.get('request')
+        view = self.context.get('view')
+        if not output.file or request is None or view is None:
+            return None
+        return request.build_absolute_uri(reverse('core:experiment-analysis-result-file', kwargs={
+            'experiment_pk': view.kwargs['experiment_pk'],
+            'pk': view.kwargs.get('pk') or output.input.analysis_id,
+            'output_pk': output.pk,
+        }))
+
+
+class AnalysisOutputListSerializer(AnalysisOutputSerializer):
+    """
+    Results list representation: results larger than the inline limit are null, and
+    entries_url pages through their entries instead.
+    """
+    results = serializers.JSONField(source='inline_results', read_only=True)
+    entries_url = serializers.SerializerMethodField()
+
+    class Meta(AnalysisOutputSerializer.Meta):
+        fields = AnalysisOutputSerializer.Meta.fields + ['entries_url']
+
+    def get_entries_url(self, output):
+        request = self.context.get('request')
+        view = self.context.get('view')
+        if not self.context.get('pageable') or output.results_size is None or request is None or view is None:
+            return None
+        return request.build_absolute_uri(reverse('core:experiment-analysis-result-entries', kwargs={
+            'experiment_pk': view.kwargs['experiment_pk'],
+            'pk': view.kwargs['pk'],
+            'output_pk': output.pk,
+        }))
 
 
 class AnalysisInputSerializer(serializers.ModelSerializer):
@@ -32,8 +70,15 @@ class AnalysisInputSerializer(serializers.ModelSerializer):
         fields = ['id', 'command', 'outputs']
 
 
+class AnalysisStageTimingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AnalysisStageTiming
+        fields = ['stage', 'wall_seconds', 'cpu_seconds', 'peak_rss_kb', 'bytes_in', 'bytes_out']
+
+
 class AnalysisSerializer(serializers.ModelSerializer):
     inputs = AnalysisInputSerializer(many=True, read_only=True)
+    stage_timings = AnalysisStageTimingSerializer(many=True, read_only=True)
 
     class Meta:
         model = Analysis
@@ -46,5 +91,26 @@ class AnalysisSerializer(serializers.ModelSerializer):
             'generated_from_analysis',
             'parameters',
             'inputs',
+            'stage_timings',
+        ]
+        read_only_fields = ['experiment', 'status']
+
+
+class AnalysisSummarySerializer(serializers.ModelSerializer):
+    """List representation: no parameters or results, only their total size."""
+    results_size = serializers.IntegerField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Analysis
+        fields = [
+            'id',
+            'title',
+            'description',
+            'type',
+            'status',
+            'generated_from_analysis',
+            'created_at',
+            'updated_at',
+            'results_size',
         ]
-        read_only_fields = ['experiment', 'status']
\ No newline at end of file
+        read_only_fields = fields
@@ -0,0 +1,33 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token
+from .models import Analysis
+from .notifications import publish_status
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    # Logout, expiry and user deletion (by cascade) all end up here
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    # The cached token carries its user: drop it on deactivation or any other change
+    if created:
+        return
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+@receiver(post_save, sender=Analysis)
+def publish_analysis_status(sender, instance, created, update_fields, **kwargs):
+    if not created and update_fields is not None and 'status' not in update_fields:
+        return
+    # Subscribers re-read the analysis, so only announce committed changes
+    analysis_id, status = instance.pk, instance.status
+    transaction.on_commit(lambda: publish_status(analysis_id, status))
@@ -0,0 +1,64 @@
+import logging
+import os
+import time
+
+from .constants import STORAGE_FILE, ARTIFACT_CACHE_MAX_BYTES, ARTIFACT_CACHE_MAX_AGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def analysis_storage_dir(analysis_id: int) -> str:
+    path = os.path.join(STORAGE_FILE, f'analysis_{analysis_id}')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def artifact_cache_dir() -> str:
+    """Content-addressed artifacts shared between analyses (see TaxonomyTreeStrategy)."""
+    path = os.path.join(STORAGE_FILE, 'artifact_cache')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def evict_artifact_cache(max_bytes: int = ARTIFACT_CACHE_MAX_BYTES,
+                         max_age_seconds: int = ARTIFACT_CACHE_MAX_AGE_SECONDS) -> int:
+    """
+    Remove artifacts unused for max_age_seconds, then the least recently used ones
+    until the cache fits in max_bytes. Cache hits touch the mtime, so it records the
+    last use. Returns how many files were removed.
+    """
+    entries = []
+    with os.scandir(artifact_cache_dir()) as it:
+        for entry in it:
+            # Skip in-progress writes of other builds
+            if not entry.is_file() or entry.name.endswith('.partial'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    oldest_kept = time.time() - max_age_seconds
+    removed = 0
+    for mtime, size, path in entries:
+        if total <= max_bytes and mtime >= oldest_kept:
+            break
+        try:
+            # Analyses holding a hard link to the artifact keep their copy
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        logger.info("Evicted %d artifacts from the cache", removed)
+    return removed
+
+
+def is_in_storage(path: str) -> bool:
+    """Whether path resolves to a location inside STORAGE_FILE (symlinks included)."""
+    root = os.path.realpath(STORAGE_FILE)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
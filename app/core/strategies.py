@@ -1,19 +1,27 @@
 # core/strategies.py
 from __future__ import annotations
 
+import functools
 import gzip
+import hashlib
+import itertools
+import json
 import logging
 import os
+import re
 import shutil
 import subprocess
-import tempfile
+import uuid
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import Optional, Dict, Tuple, List
+from typing import Optional, Dict, Tuple, List, Iterable, Iterator, Callable
 
-from django.db import transaction
-from Bio.Blast import NCBIXML
+import numpy as np
+from cache_memoize import cache_memoize
+from django.conf import settings
+from django.core.cache import cache
 from Bio.Align import PairwiseAligner
 
 from .models import (
@@ -25,11 +33,31 @@ from .models import (
 )
 from .constants import (
     PAIRWISE_ALIGNMENT_COMMAND_TEMPLATE,
+    PAIRWISE_SCORE_COMMAND_TEMPLATE,
+    PAIRWISE_MAX_SEQUENCE_LENGTH,
+    PAIRWISE_MAX_CELLS,
+    PAIRWISE_BATCH_COMMAND_TEMPLATE,
+    PAIRWISE_BATCH_MAX_SEQUENCES,
+    PAIRWISE_BATCH_MAX_SEQUENCE_LENGTH,
+    PAIRWISE_BATCH_PROCESSES,
+    PAIRWISE_BATCH_MAX_CELLS,
+    PAIRWISE_BATCH_EXCHANGE,
+    PAIRWISE_BATCH_ROUTING_KEY,
+    PAIRWISE_DEFAULT_MAX_ALIGNMENTS,
+    PAIRWISE_MAX_ALIGNMENTS,
     BLAST_DB_PATHS,
     BLASTN_EXCHANGE,
     BLASTN_ROUTING_KEY,
+    TAXONOMY_TREE_EXCHANGE,
+    TAXONOMY_TREE_ROUTING_KEY,
+    TAXONOMY_TREE_CPU_BUDGET,
+    TAXONOMY_TREE_LARGE_INPUT_SEQUENCES,
 )
-from .rabbitmq_producer import RabbitmqPublisher
+from .instrumentation import StageRecorder, StageTiming
+from .outbox import enqueue_message
+from .tool_runner import ToolRunner
+from .pairwise_batch import score_matrix
+from .storage import analysis_storage_dir, artifact_cache_dir, evict_artifact_cache
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +74,7 @@ class AnalysisExecutionResult:
     result: object = None
     file: Optional[str] = None
     type: ExecutionType = ExecutionType.SYNC
+    stages: List[StageTiming] = field(default_factory=list)
 
 class AnalysisExecutionStrategy(ABC):
     def execute(self, analysis: Analysis) -> AnalysisExecutionResult:
@@ -80,6 +109,28 @@ class AnalysisExecutionStrategy(ABC):
 
 # ---------------- Pairwise (como você já tinha) ----------------
 
+PAIRWISE_CACHE_PREFIX = 'pairwise_alignment'
+
+
+def _pairwise_cache_key(parameters: dict) -> str:
+    # Content-addressed: identical requests hash to the same key whatever the analysis
+    payload = json.dumps(parameters, sort_keys=True, separators=(',', ':'))
+    return f"{PAIRWISE_CACHE_PREFIX}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+def _count_pairwise_cache(outcome: str) -> None:
+    key = f"{PAIRWISE_CACHE_PREFIX}:{outcome}"
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+
+
+def get_pairwise_cache_stats() -> Dict[str, int]:
+    return {
+        outcome: cache.get(f"{PAIRWISE_CACHE_PREFIX}:{outcome}", 0)
+        for outcome in ('hits', 'misses')
+    }
+
+
 class PairwiseAlignmentStrategy(AnalysisExecutionStrategy):
     def _define_required_keys(self) -> dict:
         return {
@@ -93,25 +144,45 @@ class PairwiseAlignmentStrategy(AnalysisExecutionStrategy):
         }
 
     def _validate_business_rules(self, parameters):
-        return
+        output = parameters.get('output', 'all')
+        if output not in PAIRWISE_MAX_SEQUENCE_LENGTH:
+            raise ValueError(f"Parameter 'output' must be one of: {', '.join(PAIRWISE_MAX_SEQUENCE_LENGTH)}")
+        max_length = PAIRWISE_MAX_SEQUENCE_LENGTH[output]
+        for key in ('sequence_a', 'sequence_b'):
+            if len(parameters[key]) > max_length:
+                raise ValueError(f"Parameter '{key}' exceeds {max_length} characters for output '{output}'")
+        cells = len(parameters['sequence_a']) * len(parameters['sequence_b'])
+        if cells > PAIRWISE_MAX_CELLS:
+            raise ValueError(
+                f"len(sequence_a) * len(sequence_b) is {cells}; the limit is {PAIRWISE_MAX_CELLS}"
+            )
+
+        max_alignments = parameters.get('max_alignments', PAIRWISE_DEFAULT_MAX_ALIGNMENTS)
+        if not isinstance(max_alignments, int) or isinstance(max_alignments, bool):
+            raise ValueError("Parameter 'max_alignments' must be of type int")
+        if not 1 <= max_alignments <= PAIRWISE_MAX_ALIGNMENTS:
+            raise ValueError(f"Parameter 'max_alignments' must be between 1 and {PAIRWISE_MAX_ALIGNMENTS}")
 
     def _perform_analysis(self, analysis: Analysis) -> AnalysisExecutionResult:
         p = analysis.parameters
-        aligner = PairwiseAligner()
-        aligner.mode = p['mode']
-        aligner.match_score = p['match_score']
-        aligner.mismatch_score = p['mismatch_score']
-        aligner.open_gap_score = p['open_gap_score']
-        aligner.extend_gap_score = p['extend_gap_score']
-
-        alignments = aligner.align(p['sequence_a'], p['sequence_b'])
-        results = []
-        for aln in alignments:
-            target = self._add_gaps(aln.target, aln.aligned[0])
-            query = self._add_gaps(aln.query, aln.aligned[1])
-            results.append({'score': aln.score, 'query': query, 'target': target})
-
-        command = PAIRWISE_ALIGNMENT_COMMAND_TEMPLATE.format(
+        parameters = {key: p[key] for key in self._define_required_keys()}
+        parameters['output'] = p.get('output', 'all')
+        if parameters['output'] == 'single':
+            parameters['max_alignments'] = 1
+        elif parameters['output'] == 'all':
+            parameters['max_alignments'] = p.get('max_alignments', PAIRWISE_DEFAULT_MAX_ALIGNMENTS)
+        recorder = StageRecorder()
+        with recorder.stage('align') as timing:
+            timing.bytes_in = len(p['sequence_a']) + len(p['sequence_b'])
+            results = self._align(parameters)
+            timing.bytes_out = len(json.dumps(results))
+
+        template = (
+            PAIRWISE_SCORE_COMMAND_TEMPLATE
+            if parameters['output'] == 'score_only'
+            else PAIRWISE_ALIGNMENT_COMMAND_TEMPLATE
+        )
+        command = template.format(
             sequence_a=p['sequence_a'],
             sequence_b=p['sequence_b'],
             mode=p['mode'],
@@ -120,17 +191,181 @@ class PairwiseAlignmentStrategy(AnalysisExecutionStrategy):
             open_gap_score=p['open_gap_score'],
             extend_gap_score=p['extend_gap_score'],
         )
-        return AnalysisExecutionResult(command=command, result=results)
+        return AnalysisExecutionResult(command=command, result=results, stages=recorder.stages)
+
+    @cache_memoize(
+        settings.CACHE_TTL,
+        key_generator_callable=lambda self, parameters: _pairwise_cache_key(parameters),
+        hit_callable=lambda *args: _count_pairwise_cache('hits'),
+        miss_callable=lambda *args: _count_pairwise_cache('misses'),
+    )
+    def _align(self, parameters: dict) -> dict:
+        aligner = self._build_aligner(parameters)
+        if parameters['output'] == 'score_only':
+            # No traceback: O(n) memory, so this mode accepts much longer sequences
+            return {'score': aligner.score(parameters['sequence_a'], parameters['sequence_b'])}
+
+        alignments = aligner.align(parameters['sequence_a'], parameters['sequence_b'])
+        total = self._count_alignments(alignments)
+        max_alignments = parameters['max_alignments']
+        return {
+            'total': total,
+            'truncated': total is None or total > max_alignments,
+            'alignments': [
+                self._format_alignment(aln)
+                for aln in itertools.islice(alignments, max_alignments)
+            ],
+        }
+
+    def page_alignments(self, parameters: dict, offset: int, limit: int) -> dict:
+        """Regenerate the co-optimal alignments in [offset, offset + limit) of a finished analysis."""
+        alignments = self._build_aligner(parameters).align(parameters['sequence_a'], parameters['sequence_b'])
+        return {
+            'total': self._count_alignments(alignments),
+            'offset': offset,
+            'limit': limit,
+            'alignments': [
+                self._format_alignment(aln)
+                for aln in itertools.islice(alignments, offset, offset + limit)
+            ],
+        }
+
+    def _build_aligner(self, parameters: dict) -> PairwiseAligner:
+        aligner = PairwiseAligner()
+        aligner.mode = parameters['mode']
+        aligner.match_score = parameters['match_score']
+        aligner.mismatch_score = parameters['mismatch_score']
+        aligner.open_gap_score = parameters['open_gap_score']
+        aligner.extend_gap_score = parameters['extend_gap_score']
+        return aligner
+
+    def _count_alignments(self, alignments) -> Optional[int]:
+        # len() counts paths through the traceback matrix without enumerating them,
+        # but the count itself can exceed a C long for repetitive sequences
+        try:
+            return len(alignments)
+        except OverflowError:
+            return None
+
+    def _format_alignment(self, aln) -> dict:
+        target, query = self._gapped_rows(aln)
+        return {'score': aln.score, 'query': query, 'target': target}
+
+    def _gapped_rows(self, aln) -> Tuple[str, str]:
+        # Aligned blocks are the coordinate steps where both rows advance. Computed once
+        # from aln.coordinates for both rows (aln.aligned rebuilds them on every access).
+        starts = aln.coordinates[:, :-1]
+        ends = aln.coordinates[:, 1:]
+        aligned = ((ends - starts) > 0).all(axis=0)
+        return (
+            self._add_gaps(aln.target, starts[0, aligned], ends[0, aligned]),
+            self._add_gaps(aln.query, starts[1, aligned], ends[1, aligned]),
+        )
 
-    def _add_gaps(self, seq, aligned):
-        result = []
-        last_end = 0
-        for start, end in aligned:
-            result.append('-' * (start - last_end))
-            result.append(seq[start:end])
-            last_end = end
-        result.append('-' * (len(seq) - last_end))
-        return ''.join(result)
+    def _add_gaps(self, seq: str, starts: np.ndarray, ends: np.ndarray) -> str:
+        """Replace every residue of seq outside the [start, end) blocks with '-'."""
+        boundaries = np.zeros(len(seq) + 1, dtype=np.int32)
+        np.add.at(boundaries, starts, 1)
+        np.add.at(boundaries, ends, -1)
+        covered = np.cumsum(boundaries[:-1]) > 0
+        chars = np.frombuffer(seq.encode('utf-32-le'), dtype='<U1')
+        return np.where(covered, chars, '-').tobytes().decode('utf-32-le')
+
+
+# ---------------- Batch Pairwise ----------------
+
+class PairwiseBatchStrategy(AnalysisExecutionStrategy):
+    def _define_required_keys(self) -> dict:
+        return {
+            'queries': (list,),
+            'mode': str,
+            'match_score': (int, float),
+            'mismatch_score': (int, float),
+            'open_gap_score': (int, float),
+            'extend_gap_score': (int, float),
+        }
+
+    def _validate_business_rules(self, parameters: dict):
+        if 'targets' in parameters and not isinstance(parameters['targets'], list):
+            raise ValueError("Parameter 'targets' must be of type list")
+        for key in ('queries', 'targets'):
+            if key not in parameters:
+                continue
+            entries = self._sequence_entries(parameters[key], key)
+            if not entries:
+                raise ValueError(f"Parameter '{key}' must not be empty")
+            if len(entries) > PAIRWISE_BATCH_MAX_SEQUENCES:
+                raise ValueError(f"Parameter '{key}' accepts at most {PAIRWISE_BATCH_MAX_SEQUENCES} sequences")
+            for seq_id, sequence in entries:
+                if len(sequence) > PAIRWISE_BATCH_MAX_SEQUENCE_LENGTH:
+                    raise ValueError(
+                        f"Sequence '{seq_id}' in '{key}' exceeds {PAIRWISE_BATCH_MAX_SEQUENCE_LENGTH} characters"
+                    )
+
+        cells = self._count_cells(parameters)
+        if cells > PAIRWISE_BATCH_MAX_CELLS:
+            raise ValueError(
+                f"Batch needs {cells} alignment cells (sum of len(query) * len(target)); "
+                f"the limit is {PAIRWISE_BATCH_MAX_CELLS}"
+            )
+
+    def _count_cells(self, parameters: dict) -> int:
+        query_lengths = [len(sequence) for _, sequence in self._sequence_entries(parameters['queries'], 'queries')]
+        if 'targets' in parameters:
+            target_lengths = [len(sequence) for _, sequence in self._sequence_entries(parameters['targets'], 'targets')]
+            return sum(query_lengths) * sum(target_lengths)
+        # All-vs-all scores the upper triangle, diagonal included
+        return (sum(query_lengths) ** 2 + sum(length ** 2 for length in query_lengths)) // 2
+
+    def _perform_analysis(self, analysis: Analysis) -> AnalysisExecutionResult:
+        # Scoring runs in the pairwise batch worker, off the request and its transaction
+        enqueue_message(PAIRWISE_BATCH_EXCHANGE, PAIRWISE_BATCH_ROUTING_KEY, {
+            'analysis_id': analysis.id,
+            'type': analysis.type,
+        })
+        return AnalysisExecutionResult(type=ExecutionType.ASYNC)
+
+    def run_batch(self, analysis: Analysis, processes: int = PAIRWISE_BATCH_PROCESSES) -> AnalysisExecutionResult:
+        """Score a queued batch. Called by the pairwise batch worker."""
+        p = analysis.parameters
+        queries = self._sequence_entries(p['queries'], 'queries')
+        targets = self._sequence_entries(p['targets'], 'targets') if 'targets' in p else None
+
+        # Without targets this is an all-vs-all comparison of the queries
+        recorder = StageRecorder()
+        with recorder.stage('score_matrix') as timing:
+            timing.bytes_in = sum(len(sequence) for _, sequence in queries + (targets or []))
+            scores, timing.peak_rss_kb = score_matrix(
+                p,
+                [sequence for _, sequence in queries],
+                [sequence for _, sequence in targets] if targets is not None else None,
+                processes=processes,
+            )
+
+        command = PAIRWISE_BATCH_COMMAND_TEMPLATE.format(
+            mode=p['mode'],
+            match_score=p['match_score'],
+            mismatch_score=p['mismatch_score'],
+            open_gap_score=p['open_gap_score'],
+            extend_gap_score=p['extend_gap_score'],
+        )
+        return AnalysisExecutionResult(command=command, result={
+            'queries': [seq_id for seq_id, _ in queries],
+            'targets': [seq_id for seq_id, _ in (targets if targets is not None else queries)],
+            'scores': scores,
+        }, stages=recorder.stages)
+
+    def _sequence_entries(self, items: list, key: str) -> List[Tuple[str, str]]:
+        """Accept plain sequences or {'id', 'sequence'} objects."""
+        entries = []
+        for i, item in enumerate(items, start=1):
+            if isinstance(item, str):
+                entries.append((f'{key}_{i}', item))
+            elif isinstance(item, dict) and isinstance(item.get('sequence'), str):
+                entries.append((str(item.get('id') or f'{key}_{i}'), item['sequence']))
+            else:
+                raise ValueError(f"Parameter '{key}' items must be strings or objects with a 'sequence' string")
+        return entries
 
 
 # ---------------- Homology Search (mantida) ----------------
@@ -155,8 +390,7 @@ class HomologySearchStrategy(AnalysisExecutionStrategy):
 
     def _perform_analysis(self, analysis: Analysis) -> AnalysisExecutionResult:
         analysis.parameters['database'] = BLAST_DB_PATHS[analysis.parameters['database']]
-        publisher = RabbitmqPublisher(exchange=BLASTN_EXCHANGE, routing_key=BLASTN_ROUTING_KEY)
-        publisher.send_message({
+        enqueue_message(BLASTN_EXCHANGE, BLASTN_ROUTING_KEY, {
             'analysis_id': analysis.id,
             'parameters': analysis.parameters,
             'type': analysis.type,
@@ -166,6 +400,59 @@ class HomologySearchStrategy(AnalysisExecutionStrategy):
 
 # ---------------- Taxonomy Tree ----------------
 
+# Only what the tree needs: a few bytes per hit instead of the full XML report
+TREE_HITS_OUTFMT = '6 qseqid sseqid bitscore sseq'
+# Version probes run outside the ToolRunner; they should return immediately
+TOOL_VERSION_TIMEOUT_SECONDS = 30
+COPY_BUFFER_SIZE = 1024 * 1024
+# Stages served from the artifact cache are recorded apart from the tool runs they replace
+CACHED_STAGE_SUFFIX = '_cached'
+# Leaf ids written to the MSA input, as they appear in the FastTree output
+NEWICK_LEAF_ID = re.compile(r'(?<=[(,])s\d+(?=[:,);])|^s\d+(?=;)')
+NEWICK_UNSAFE = re.compile(r"[\s(),:;\[\]']")
+
+
+@dataclass(frozen=True)
+class TreeToolEngine:
+    """An external MSA or tree-building tool. command(input, output, threads) builds its argv."""
+    command: Callable[[str, str, str], List[str]]
+    version_command: Tuple[str, ...]
+    writes_stdout: bool = False
+    omp_threads: bool = False
+
+
+MSA_ENGINES: Dict[str, TreeToolEngine] = {
+    # 'muscle' is MUSCLE 3.8 (see setup.sh), single-threaded
+    'muscle3': TreeToolEngine(
+        command=lambda fasta_in, fasta_out, threads: ['muscle', '-in', fasta_in, '-out', fasta_out],
+        version_command=('muscle', '-version'),
+    ),
+    'muscle5': TreeToolEngine(
+        command=lambda fasta_in, fasta_out, threads: ['muscle5', '-align', fasta_in, '-output', fasta_out, '-threads', threads],
+        version_command=('muscle5', '-version'),
+    ),
+    'mafft': TreeToolEngine(
+        command=lambda fasta_in, fasta_out, threads: ['mafft', '--auto', '--thread', threads, fasta_in],
+        version_command=('mafft', '--version'),
+        writes_stdout=True,
+    ),
+}
+
+TREE_ENGINES: Dict[str, TreeToolEngine] = {
+    'fasttree': TreeToolEngine(
+        command=lambda aligned_fasta, nwk_out, threads: ['fasttree', '-nt', aligned_fasta],
+        version_command=('fasttree', '-help'),
+        writes_stdout=True,
+    ),
+    'fasttreemp': TreeToolEngine(
+        command=lambda aligned_fasta, nwk_out, threads: ['fasttreeMP', '-nt', aligned_fasta],
+        version_command=('fasttreeMP', '-help'),
+        writes_stdout=True,
+        omp_threads=True,
+    ),
+}
+
+
 class TaxonomyTreeStrategy(AnalysisExecutionStrategy):
 
     def __init__(self):
@@ -176,6 +463,16 @@ class TaxonomyTreeStrategy(AnalysisExecutionStrategy):
         return {'generated_from_analysis': (int,)}
 
     def _validate_business_rules(self, parameters: dict):
+        if parameters.get('aligner', 'muscle3') not in MSA_ENGINES:
+            raise ValueError(f"Parameter 'aligner' must be one of: {', '.join(MSA_ENGINES)}")
+        if parameters.get('tree_builder', 'fasttree') not in TREE_ENGINES:
+            raise ValueError(f"Parameter 'tree_builder' must be one of: {', '.join(TREE_ENGINES)}")
+        max_sequences = parameters.get('max_sequences')
+        if max_sequences is not None and (
+            not isinstance(max_sequences, int) or isinstance(max_sequences, bool) or max_sequences < 1
+        ):
+            raise ValueError("Parameter 'max_sequences' must be a positive integer")
+
         parent_id = parameters['generated_from_analysis']
         parent = Analysis.objects.filter(pk=parent_id).first()
 
@@ -188,15 +485,32 @@ class TaxonomyTreeStrategy(AnalysisExecutionStrategy):
         
         self.parent_analysis = parent
 
-    @transaction.atomic
     def _perform_analysis(self, analysis: Analysis) -> AnalysisExecutionResult:
         analysis.generated_from_analysis = self.parent_analysis
         analysis.save(update_fields=['generated_from_analysis'])
 
+        # The pipeline runs in the taxonomy tree worker
+        enqueue_message(TAXONOMY_TREE_EXCHANGE, TAXONOMY_TREE_ROUTING_KEY, {
+            'analysis_id': analysis.id,
+            'type': analysis.type,
+        })
+        return AnalysisExecutionResult(type=ExecutionType.ASYNC)
+
+    def run_pipeline(self, analysis: Analysis, runner: Optional[ToolRunner] = None) -> AnalysisExecutionResult:
+        """
+        Build the tree for a queued analysis. Called by the taxonomy tree worker, which
+        passes a runner that stops the external tools when the analysis is cancelled.
+        """
+        runner = runner or ToolRunner()
+        recorder = StageRecorder()
+        parent_analysis = analysis.generated_from_analysis
+        if parent_analysis is None:
+            raise ValueError('Parent analysis not found')
+
         # 1) Locate the fmt11 (.gz) file from the parent analysis (via generic AnalysisOutput)
         parent_out = (
             AnalysisOutput.objects
-            .filter(input__analysis_id=self.parent_analysis.id)
+            .filter(input__analysis_id=parent_analysis.id)
             .order_by('-id')
             .first()
         )
@@ -206,102 +520,265 @@ class TaxonomyTreeStrategy(AnalysisExecutionStrategy):
         # 2) Storage directory for the current analysis (child)
         storage_dir = self._storage_dir(analysis.id)
 
-        # 3) Decompress fmt11 .gz
-        archive_path = self._decompress_to(storage_dir, parent_out.file, name='homology_archive', ext='fmt11')
-
-        # 4) Convert fmt11 to XML using blast_formatter
-        xml_tmp = self._tmp('.xml')
-        self._run_blast_formatter_to_xml(archive_path, xml_tmp)
-        xml_path = self._move_to_storage(xml_tmp, storage_dir, 'blast_output', 'xml')
-
-        # 5) Parse XML and extract best hits
-        records = self._parse_blast_xml(xml_path)
-        best_hits = self._extract_best_hits(records)
-        if not best_hits:
-            raise ValueError('No best hits found in BLAST XML output')
-
-        # 6) Generate FASTA file with best hits
-        fasta_tmp = self._write_fasta(best_hits)
-        fasta_path = self._move_to_storage(fasta_tmp, storage_dir, 'tree_muscle_input', 'fasta')
+        # Stages are cached by content: each key chains the previous stage's key with the
+        # tool version and options, so re-requests from the same parent reuse every stage
+        # and only stages whose tool or options changed are rebuilt.
+        hits_key = self._artifact_key(
+            'hits', self._file_sha256(parent_out.file),
+            self._tool_version(('blast_formatter', '-version')), TREE_HITS_OUTFMT,
+        )
 
-        # 7) Align sequences using MUSCLE
-        aligned_tmp = self._tmp('.fasta')
-        self._run_muscle(fasta_path, aligned_tmp)
-        aligned_path = self._move_to_storage(aligned_tmp, storage_dir, 'tree_muscle_out', 'fasta')
+        # 3-5) Decompress fmt11 and stream the best hit per query from blast_formatter
+        hits_path = self._storage_path(storage_dir, 'tree_best_hits', 'tsv')
+        self._cached_stage(
+            hits_key, hits_path, lambda out: self._build_best_hits(runner, recorder, storage_dir, parent_out.file, out),
+        )
 
-        # 8) Generate phylogenetic tree using FastTree
-        nwk_tmp = self._tmp('.nwk')
-        self._run_fasttree(aligned_path, nwk_tmp)
-        nwk_path = self._move_to_storage(nwk_tmp, storage_dir, 'tree', 'nwk')
+        # 6) Collapse identical sequences into one leaf each (optionally capping the leaf
+        #    count) and write the MSA input with short, Newick-safe leaf ids
+        max_sequences = analysis.parameters.get('max_sequences')
+        fasta_path = self._storage_path(storage_dir, 'tree_muscle_input', 'fasta')
+        with recorder.stage('collapse', inputs=[hits_path], outputs=[fasta_path]):
+            leaves, summary = self._collapse_sequences(hits_path, max_sequences)
+            with self._atomic_output(fasta_path) as partial:
+                self._write_fasta(leaves, partial)
+
+        # Engines come from the parameters or are picked by input size
+        aligner_name, tree_builder_name = self._select_engines(analysis.parameters, len(leaves))
+        aligner, tree_builder = MSA_ENGINES[aligner_name], TREE_ENGINES[tree_builder_name]
+        threads = TAXONOMY_TREE_CPU_BUDGET
+
+        # Thread counts do not change the result, so they are left out of the cache keys
+        aligned_key = self._artifact_key(
+            'msa', hits_key, f'collapse:{max_sequences}',
+            self._tool_version(aligner.version_command), *aligner.command('{in}', '{out}', '{threads}'),
+        )
+        tree_key = self._artifact_key(
+            'tree', aligned_key, self._tool_version(tree_builder.version_command),
+            *tree_builder.command('{in}', '{out}', '{threads}'),
+        )
 
-        with open(nwk_path, 'r', encoding='utf-8') as fh:
-            nwk_content = fh.read().strip()
+        collapsed_nwk_path = self._storage_path(storage_dir, 'tree_collapsed', 'nwk')
+        if len(leaves) == 1:
+            # Nothing to align: every query hit the same sequence
+            with self._atomic_output(collapsed_nwk_path) as partial, open(partial, 'w', encoding='utf-8') as fh:
+                fh.write(f"{leaves[0][0]};\n")
+        else:
+            # 7) Multiple sequence alignment
+            aligned_path = self._storage_path(storage_dir, 'tree_muscle_out', 'fasta')
+            with recorder.stage(aligner_name, inputs=[fasta_path], outputs=[aligned_path], runner=runner) as timing:
+                if self._cached_stage(
+                    aligned_key, aligned_path, lambda out: self._run_engine(runner, aligner, fasta_path, out, threads),
+                ):
+                    timing.stage = f'{aligner_name}{CACHED_STAGE_SUFFIX}'
+
+            # 8) Generate phylogenetic tree
+            with recorder.stage(tree_builder_name, inputs=[aligned_path], outputs=[collapsed_nwk_path],
+                                runner=runner) as timing:
+                if self._cached_stage(
+                    tree_key, collapsed_nwk_path,
+                    lambda out: self._run_engine(runner, tree_builder, aligned_path, out, threads),
+                ):
+                    timing.stage = f'{tree_builder_name}{CACHED_STAGE_SUFFIX}'
+
+        # 9) Re-expand collapsed leaves into the query ids they stand for
+        nwk_path = self._storage_path(storage_dir, 'tree', 'nwk')
+        with recorder.stage('expand', inputs=[collapsed_nwk_path], outputs=[nwk_path]):
+            with open(collapsed_nwk_path, 'r', encoding='utf-8') as fh:
+                nwk_content = self._expand_leaves(fh.read().strip(), leaves)
+            with self._atomic_output(nwk_path) as partial, open(partial, 'w', encoding='utf-8') as fh:
+                fh.write(f"{nwk_content}\n")
 
         return AnalysisExecutionResult(
-            command="blast_formatter | muscle | fasttree",
-            result={'nwk': nwk_content},
+            command=f"blast_formatter | {aligner_name} | {tree_builder_name}",
+            result={'nwk': nwk_content, 'aligner': aligner_name, 'tree_builder': tree_builder_name, **summary},
             file=nwk_path,
             type=ExecutionType.SYNC,
+            stages=recorder.stages,
         )
 
     # ---------- helpers ----------
     def _storage_dir(self, analysis_id: int) -> str:
-        base = os.environ.get('STORAGE_FILE', '/mnt/data/blastn_storage')
-        path = os.path.join(base, f'analysis_{analysis_id}')
-        os.makedirs(path, exist_ok=True)
-        return path
+        return analysis_storage_dir(analysis_id)
+
+    def _storage_path(self, storage_dir: str, name: str, ext: str) -> str:
+        return os.path.join(storage_dir, f"{name}.{ext}")
+
+    @contextmanager
+    def _atomic_output(self, path: str) -> Iterator[str]:
+        """
+        Yield a partial path next to path for a stage to write into. On success it is
+        renamed over path (same directory, so no copy); on failure it is removed. The
+        name is unique per run, so concurrent builds of the same path cannot interleave.
+        """
+        partial = f"{path}.{uuid.uuid4().hex}.partial"
+        try:
+            yield partial
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def _build_best_hits(self, runner: ToolRunner, recorder: StageRecorder, storage_dir: str, gz_path: str,
+                         hits_out: str) -> None:
+        # The decompressed archive is only needed by blast_formatter and can be rebuilt
+        # from the parent, so it is removed once the hits are read.
+        archive_path = self._storage_path(storage_dir, 'homology_archive', 'fmt11')
+        with recorder.stage('decompress', inputs=[gz_path], outputs=[archive_path]):
+            self._decompress_to(storage_dir, gz_path, name='homology_archive', ext='fmt11')
+        try:
+            with recorder.stage('blast_formatter', inputs=[archive_path], runner=runner) as timing:
+                best_hits = self._stream_best_hits(runner, archive_path)
+                timing.bytes_out = sum(len(sseq) for _, _, sseq in best_hits.values())
+        finally:
+            os.remove(archive_path)
+        if not best_hits:
+            raise ValueError('No best hits found in BLAST output')
+        with open(hits_out, 'w', encoding='utf-8') as fh:
+            for query_id, (hit_id, bitscore, sseq) in best_hits.items():
+                fh.write(f"{query_id}\t{hit_id}\t{bitscore}\t{sseq}\n")
+
+    def _cached_stage(self, key: str, path: str, build: Callable[[str], None]) -> bool:
+        """
+        Materialize path from the artifact cache, or build it and add it to the cache.
+        Returns whether it came from the cache.
+        """
+        cached = os.path.join(artifact_cache_dir(), f"{key}{os.path.splitext(path)[1]}")
+        try:
+            with self._atomic_output(path) as partial:
+                self._link_or_copy(cached, partial)
+        except FileNotFoundError:
+            # Not cached yet, or evicted by another worker
+            pass
+        else:
+            logger.info("Reusing cached artifact %s for %s", cached, path)
+            # Eviction is least recently used first
+            with suppress(FileNotFoundError):
+                os.utime(cached)
+            return True
+
+        with self._atomic_output(path) as partial:
+            build(partial)
+        with self._atomic_output(cached) as partial:
+            self._link_or_copy(path, partial)
+        evict_artifact_cache()
+        return False
+
+    def _link_or_copy(self, src: str, dst: str) -> None:
+        # Artifacts are never modified in place, so a hard link can be shared safely
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    def _artifact_key(self, stage: str, *parts: str) -> str:
+        return hashlib.sha256('\0'.join((stage,) + parts).encode()).hexdigest()
+
+    def _file_sha256(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(COPY_BUFFER_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _tool_version(cmd: Tuple[str, ...]) -> str:
+        try:
+            completed = subprocess.run(
+                list(cmd), text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=TOOL_VERSION_TIMEOUT_SECONDS,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return 'unknown'
+        lines = [line.strip() for line in completed.stdout.splitlines() if line.strip()]
+        return lines[0] if lines else 'unknown'
 
-    def _tmp(self, suffix: str) -> str:
-        return tempfile.NamedTemporaryFile(delete=False, suffix=suffix).name
+    def _decompress_to(self, storage_dir: str, gz_path: str, name: str, ext: str) -> str:
+        path = self._storage_path(storage_dir, name, ext)
+        with self._atomic_output(path) as partial:
+            with gzip.open(gz_path, 'rb') as f_in, open(partial, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out, COPY_BUFFER_SIZE)
+        return path
 
-    def _move_to_storage(self, src: str, storage_dir: str, name: str, ext: str) -> str:
-        dst = os.path.join(storage_dir, f"{name}.{ext}")
-        shutil.move(src, dst)
-        return dst
+    def _stream_best_hits(self, runner: ToolRunner, archive_path: str) -> Dict[str, Tuple[str, float, str]]:
+        cmd = ['blast_formatter', '-archive', archive_path, '-outfmt', TREE_HITS_OUTFMT]
+        with runner.open(cmd, stdout=subprocess.PIPE) as proc:
+            return self._extract_best_hits(proc.stdout)
 
-    def _decompress_to(self, storage_dir: str, gz_path: str, name: str, ext: str) -> str:
-        tmp = self._tmp(f".{ext}")
-        with gzip.open(gz_path, 'rb') as f_in, open(tmp, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-        return self._move_to_storage(tmp, storage_dir, name, ext)
-
-    def _run_blast_formatter_to_xml(self, archive_path: str, xml_out: str) -> None:
-        cmd = ['blast_formatter', '-archive', archive_path, '-outfmt', '5', '-out', xml_out]
-        logger.info("Running: %s", ' '.join(cmd))
-        subprocess.run(cmd, check=True, text=True)
-
-    def _parse_blast_xml(self, xml_path: str):
-        with open(xml_path, 'r', encoding='utf-8') as handle:
-            return list(NCBIXML.parse(handle))
-
-    def _extract_best_hits(self, records) -> Dict[str, Tuple[str, str]]:
-        best: Dict[str, Tuple[str, str]] = {}
-        for rec in records:
-            best_hsp = None
-            best_alignment = None
-            for aln in rec.alignments:
-                for hsp in aln.hsps:
-                    if best_hsp is None or hsp.score > best_hsp.score:
-                        best_hsp = hsp
-                        best_alignment = aln
-            if best_hsp and best_alignment:
-                best[rec.query] = (best_alignment.hit_id, best_hsp.sbjct)
+    def _extract_best_hits(self, lines: Iterable[str]) -> Dict[str, Tuple[str, float, str]]:
+        best: Dict[str, Tuple[str, float, str]] = {}
+        for line in lines:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            query_id, hit_id, bitscore, sseq = line.split('\t')
+            score = float(bitscore)
+            current = best.get(query_id)
+            if current is None or score > current[1]:
+                best[query_id] = (hit_id, score, sseq)
         return best
 
-    def _write_fasta(self, best_hits: Dict[str, Tuple[str, str]]) -> str:
-        tmp = self._tmp('.fasta')
-        with open(tmp, 'wb') as fh:
-            for query_id, (_hit_id, seq) in best_hits.items():
-                fh.write(f">{query_id}\n{seq}\n".encode())
-        return tmp
-
-    def _run_muscle(self, fasta_in: str, fasta_out: str) -> None:
-        cmd = ['muscle', '-in', fasta_in, '-out', fasta_out]
-        logger.info("Running: %s", ' '.join(cmd))
-        subprocess.run(cmd, check=True, text=True)
-
-    def _run_fasttree(self, aligned_fasta: str, nwk_out: str) -> None:
-        cmd = ['fasttree', '-nt', aligned_fasta]
-        logger.info("Running: %s > %s", ' '.join(cmd), nwk_out)
-        with open(nwk_out, 'w', encoding='utf-8') as out:
-            subprocess.run(cmd, check=True, text=True, stdout=out)
\ No newline at end of file
+    def _collapse_sequences(self, hits_path: str, max_sequences: Optional[int]) -> Tuple[List[Tuple[str, str, List[str]]], dict]:
+        """
+        Group queries whose best-hit sequences are identical (ignoring gaps and case) and,
+        if max_sequences is set, keep only the best supported groups: most queries first,
+        then highest bitscore. Returns (leaf_id, sequence, query_ids) per leaf and a summary.
+        """
+        groups: Dict[str, Tuple[float, List[str]]] = {}
+        with open(hits_path, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                query_id, _hit_id, bitscore, sseq = line.rstrip('\n').split('\t')
+                sequence = sseq.replace('-', '').upper()
+                best_score, query_ids = groups.get(sequence, (float(bitscore), []))
+                query_ids.append(query_id)
+                groups[sequence] = (max(best_score, float(bitscore)), query_ids)
+
+        total = sum(len(query_ids) for _, query_ids in groups.values())
+        kept = list(groups.items())
+        if max_sequences and len(kept) > max_sequences:
+            ranked = sorted(range(len(kept)), key=lambda i: (-len(kept[i][1][1]), -kept[i][1][0], i))
+            kept = [kept[i] for i in sorted(ranked[:max_sequences])]
+        kept_queries = sum(len(query_ids) for _, (_, query_ids) in kept)
+
+        leaves = [(f's{i}', sequence, query_ids) for i, (sequence, (_, query_ids)) in enumerate(kept, start=1)]
+        summary = {
+            'sequences': total,
+            'unique_sequences': len(groups),
+            'collapsed_sequences': total - len(groups),
+            'sampled_out_sequences': total - kept_queries,
+            'leaves': len(leaves),
+        }
+        return leaves, summary
+
+    def _write_fasta(self, leaves: List[Tuple[str, str, List[str]]], fasta_out: str) -> None:
+        with open(fasta_out, 'w', encoding='utf-8') as fh:
+            for leaf_id, sequence, _query_ids in leaves:
+                fh.write(f">{leaf_id}\n{sequence}\n")
+
+    def _expand_leaves(self, nwk: str, leaves: List[Tuple[str, str, List[str]]]) -> str:
+        """Replace each leaf id with its query id, or with a zero-length polytomy of them."""
+        labels = {}
+        for leaf_id, _sequence, query_ids in leaves:
+            names = [self._newick_label(query_id) for query_id in query_ids]
+            labels[leaf_id] = names[0] if len(names) == 1 else f"({','.join(f'{name}:0' for name in names)})"
+        return NEWICK_LEAF_ID.sub(lambda match: labels.get(match.group(0), match.group(0)), nwk)
+
+    def _newick_label(self, name: str) -> str:
+        if NEWICK_UNSAFE.search(name):
+            return "'" + name.replace("'", "''") + "'"
+        return name
+
+    def _select_engines(self, parameters: dict, sequence_count: int) -> Tuple[str, str]:
+        large = sequence_count > TAXONOMY_TREE_LARGE_INPUT_SEQUENCES
+        aligner = parameters.get('aligner', 'mafft' if large else 'muscle3')
+        tree_builder = parameters.get('tree_builder', 'fasttreemp' if large else 'fasttree')
+        return aligner, tree_builder
+
+    def _run_engine(self, runner: ToolRunner, engine: TreeToolEngine, input_path: str, output_path: str, threads: int) -> None:
+        cmd = engine.command(input_path, output_path, str(threads))
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads)) if engine.omp_threads else None
+        if not engine.writes_stdout:
+            runner.run(cmd, env=env, threads=threads)
+            return
+        with open(output_path, 'w', encoding='utf-8') as out:
+            runner.run(cmd, stdout=out, env=env, threads=threads)
@@ -1,6 +1,7 @@
 from .strategies import (
     AnalysisExecutionStrategy,
     PairwiseAlignmentStrategy,
+    PairwiseBatchStrategy,
     HomologySearchStrategy,
     TaxonomyTreeStrategy
 )
@@ -12,6 +13,7 @@ class StrategyFactory:
         AnalysisTypeChoices.PAIRWISE_ALIGNMENT: PairwiseAlignmentStrategy(),
         AnalysisTypeChoices.HOMOLOGY_SEARCH: HomologySearchStrategy(),
         AnalysisTypeChoices.TAXONOMY_TREE: TaxonomyTreeStrategy(),
+        AnalysisTypeChoices.PAIRWISE_BATCH: PairwiseBatchStrategy(),
     }
 
     @staticmethod
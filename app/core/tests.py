@@ -1,3 +1,921 @@
-from django.test import TestCase
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from pika.exceptions import AMQPConnectionError, ConnectionWrongStateError, NackError
+from rest_framework.test import APIClient
+
+from .authentication import TOKEN_CACHE_PREFIX, local_token_cache
+from .execution import AnalysisHeartbeat, reap_stale_analyses, start_analysis, store_execution_result
+from .instrumentation import StageRecorder
+from .notifications import status_events
+from .outbox import enqueue_message, relay_pending_messages
+from .rabbitmq_consumer import RabbitmqConsumer
+from .models import (
+    Experiment,
+    Analysis,
+    AnalysisInput,
+    AnalysisOutput,
+    AnalysisStageTiming,
+    AnalysisStatusChoices,
+    AnalysisTypeChoices,
+    OutboxMessage,
+)
+from .storage import analysis_storage_dir, artifact_cache_dir, evict_artifact_cache
+from .strategies import (
+    AnalysisExecutionResult,
+    ExecutionType,
+    PairwiseAlignmentStrategy,
+    PairwiseBatchStrategy,
+    TaxonomyTreeStrategy,
+)
+from .tool_runner import ToolLimits, ToolRunner
+
+# Fixed queue names, so that queuing analyses does not depend on the docker env
+QUEUE_CONSTANTS = {
+    f'{name}_{setting}': f'{name.lower()}_{setting.lower()}'
+    for name in ('BLASTN', 'TAXONOMY_TREE', 'PAIRWISE_BATCH')
+    for setting in ('EXCHANGE', 'ROUTING_KEY')
+}
+
+
+class QueryCountTests(TestCase):
+    """
+    Each endpoint must issue a fixed number of queries however many analyses,
+    inputs and outputs there are. A failing count usually means a serializer
+    field was added without a matching select_related/prefetch_related.
+    Counts exclude authentication, which is served from the token cache.
+    """
+
+    def setUp(self):
+        local_token_cache.clear()
+        self.user = User.objects.create_user(username='user', password='password')
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.experiment = Experiment.objects.create(title='experiment', description='', user=self.user)
+
+    def _create_analyses(self, count, inputs=1, outputs=1):
+        for i in range(count):
+            analysis = Analysis.objects.create(
+                title=f'analysis {i}',
+                type=AnalysisTypeChoices.PAIRWISE_ALIGNMENT,
+                status=AnalysisStatusChoices.SUCCEEDED,
+                experiment=self.experiment,
+                parameters={},
+            )
+            for _ in range(inputs):
+                analysis_input = AnalysisInput.objects.create(command='command', analysis=analysis)
+                for _ in range(outputs):
+                    AnalysisOutput.objects.create(results={'score': 1}, results_size=len('{"score": 1}'), input=analysis_input)
+            AnalysisStageTiming.objects.create(
+                analysis=analysis, stage='align', wall_seconds=0.1, cpu_seconds=0.1, peak_rss_kb=1,
+            )
+        return analysis
+
+    def _assert_constant_queries(self, url, num, grow):
+        self.client.get(url)
+        with self.assertNumQueries(num):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        grow()
+        with self.assertNumQueries(num):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def _analysis_list_url(self):
+        return reverse('core:experiment-analysis-list', kwargs={'experiment_pk': self.experiment.pk})
+
+    def test_analysis_list(self):
+        # analyses with their summed results size
+        self._create_analyses(2)
+        self._assert_constant_queries(
+            self._analysis_list_url(), 1, lambda: self._create_analyses(13, inputs=2, outputs=3),
+        )
+
+    def test_analysis_list_is_summary(self):
+        self._create_analyses(1, inputs=2, outputs=2)
+        analysis = self.client.get(self._analysis_list_url()).json()['results'][0]
+        self.assertNotIn('parameters', analysis)
+        self.assertNotIn('inputs', analysis)
+        self.assertEqual(analysis['results_size'], 4 * len('{"score": 1}'))
+
+    def test_analysis_list_pages_by_cursor(self):
+        self._create_analyses(5)
+        url = f'{self._analysis_list_url()}?page_size=2'
+        ids = []
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 2)
+            ids.extend(analysis['id'] for analysis in page['results'])
+            url = page['next']
+        self.assertEqual(ids, sorted(Analysis.objects.values_list('id', flat=True), reverse=True))
+
+    def test_analysis_list_page_size_is_capped(self):
+        self._create_analyses(3)
+        with mock.patch('core.pagination.IdCursorPagination.max_page_size', 2):
+            page = self.client.get(f'{self._analysis_list_url()}?page_size=50').json()
+        self.assertEqual(len(page['results']), 2)
+        self.assertNotIn('count', page)
+
+    def test_analysis_retrieve(self):
+        # version, analysis, inputs, outputs, stage timings; running analyses bypass the response cache
+        analysis = self._create_analyses(1)
+        Analysis.objects.filter(pk=analysis.pk).update(status=AnalysisStatusChoices.STARTED)
+        url = reverse('core:experiment-analysis-detail', kwargs={
+            'experiment_pk': self.experiment.pk, 'pk': analysis.pk,
+        })
+
+        def grow():
+            for _ in range(5):
+                analysis_input = AnalysisInput.objects.create(command='command', analysis=analysis)
+                AnalysisOutput.objects.create(results={}, input=analysis_input)
+
+        self._assert_constant_queries(url, 5, grow)
+
+    def test_analysis_results(self):
+        # analysis, outputs
+        analysis = self._create_analyses(1)
+        url = reverse('core:experiment-analysis-results', kwargs={
+            'experiment_pk': self.experiment.pk, 'pk': analysis.pk,
+        })
+
+        def grow():
+            analysis_input = AnalysisInput.objects.create(command='command', analysis=analysis)
+            for _ in range(5):
+                AnalysisOutput.objects.create(results={}, input=analysis_input)
+
+        self._assert_constant_queries(url, 2, grow)
+
+    def test_experiment_list(self):
+        # experiments
+        def grow():
+            for i in range(20):
+                Experiment.objects.create(title=f'experiment {i}', description='', user=self.user)
+
+        self._assert_constant_queries(reverse('core:experiment-list'), 1, grow)
+
+    def test_experiment_retrieve(self):
+        # version, experiment
+        url = reverse('core:experiment-detail', kwargs={'pk': self.experiment.pk})
+        self._assert_constant_queries(url, 2, lambda: self._create_analyses(10))
+
+
+class TokenAuthenticationTests(TestCase):
+    def setUp(self):
+        local_token_cache.clear()
+        self.user = User.objects.create_user(username='user', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('core:experiment-list')
+
+    def test_cached_token_needs_no_query(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        # experiments only
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cached_token_leaves_out_the_password_hash(self):
+        self.client.get(self.url)
+        cached = pickle.dumps(cache.get(f'{TOKEN_CACHE_PREFIX}:{self.token.key}'))
+        self.assertNotIn(self.user.password.encode(), cached)
+        # Still loaded on demand
+        self.assertTrue(local_token_cache.get(self.token.key).user.check_password('password'))
+
+    def test_logout_invalidates_token(self):
+        self.client.get(self.url)
+        self.assertEqual(self.client.post(reverse('core:logout')).status_code, 204)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivation_invalidates_token(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_expired_token_is_deleted(self):
+        Token.objects.filter(pk=self.token.pk).update(created=timezone.now() - timedelta(days=1))
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        self.assertFalse(Token.objects.filter(pk=self.token.pk).exists())
+
+
+class AnalysisStatusNotificationTests(TestCase):
+    def setUp(self):
+        local_token_cache.clear()
+        self.user = User.objects.create_user(username='user', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.experiment = Experiment.objects.create(title='experiment', description='', user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.analysis = Analysis.objects.create(
+                title='search',
+                type=AnalysisTypeChoices.HOMOLOGY_SEARCH,
+                experiment=self.experiment,
+                parameters={},
+            )
+
+    def _events_url(self, analysis):
+        return reverse('core:experiment-analysis-events', kwargs={
+            'experiment_pk': analysis.experiment_id, 'pk': analysis.pk,
+        })
+
+    @mock.patch('core.signals.publish_status')
+    def test_status_change_is_published_on_commit(self, publish_status):
+        self.analysis.status = AnalysisStatusChoices.SUCCEEDED
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.analysis.save(update_fields=['status'])
+        publish_status.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        publish_status.assert_called_once_with(self.analysis.pk, AnalysisStatusChoices.SUCCEEDED)
+
+    @mock.patch('core.signals.publish_status')
+    def test_other_fields_are_not_published(self, publish_status):
+        self.analysis.title = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.analysis.save(update_fields=['title'])
+        publish_status.assert_not_called()
+
+    def test_events_require_authentication(self):
+        self.assertEqual(self.client.get(self._events_url(self.analysis)).status_code, 401)
+
+    def _collect_events(self, messages):
+        """Run status_events against a fake Redis whose pubsub returns messages in turn."""
+        pubsub = mock.Mock(
+            subscribe=mock.AsyncMock(),
+            get_message=mock.AsyncMock(side_effect=[
+                None if status is None else {'data': json.dumps({'id': self.analysis.pk, 'status': status})}
+                for status in messages
+            ]),
+            aclose=mock.AsyncMock(),
+        )
+        client = mock.Mock(pubsub=mock.Mock(return_value=pubsub), aclose=mock.AsyncMock())
+
+        async def collect():
+            return [event async for event in status_events(self.analysis.pk)]
+
+        with mock.patch('core.notifications.aioredis.from_url', return_value=client):
+            events = async_to_sync(collect)()
+        pubsub.aclose.assert_awaited_once()
+        client.aclose.assert_awaited_once()
+        return events
+
+    def _status_event(self, status):
+        return f"event: status\ndata: {json.dumps({'id': self.analysis.pk, 'status': status})}\n\n"
+
+    def test_events_start_with_the_current_status(self):
+        Analysis.objects.filter(pk=self.analysis.pk).update(status=AnalysisStatusChoices.SUCCEEDED)
+        self.assertEqual(self._collect_events([]), [
+            'retry: 3000\n\n', self._status_event(AnalysisStatusChoices.SUCCEEDED),
+        ])
+
+    def test_events_relay_changes_until_a_final_status(self):
+        events = self._collect_events([None, AnalysisStatusChoices.STARTED, AnalysisStatusChoices.SUCCEEDED])
+        self.assertEqual(events, [
+            'retry: 3000\n\n',
+            self._status_event(AnalysisStatusChoices.WAITING),
+            ': heartbeat\n\n',
+            self._status_event(AnalysisStatusChoices.STARTED),
+            self._status_event(AnalysisStatusChoices.SUCCEEDED),
+        ])
+
+    def test_events_end_after_their_lifetime(self):
+        # Unread streams are not cancelled on disconnect, so every stream ends in time
+        with mock.patch('core.notifications.ANALYSIS_EVENTS_MAX_SECONDS', 0):
+            events = self._collect_events([None])
+        self.assertEqual(events, ['retry: 3000\n\n', self._status_event(AnalysisStatusChoices.WAITING)])
+
+    def test_events_of_another_user(self):
+        other = User.objects.create_user(username='other', password='password')
+        other_token = Token.objects.create(user=other)
+        response = self.client.get(
+            self._events_url(self.analysis), HTTP_AUTHORIZATION=f'Token {other_token.key}',
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        local_token_cache.clear()
+        user = User.objects.create_user(username='user', password='password')
+        token = Token.objects.create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.experiment = Experiment.objects.create(title='experiment', description='', user=user)
+        self.analysis = Analysis.objects.create(
+            title='analysis',
+            type=AnalysisTypeChoices.PAIRWISE_ALIGNMENT,
+            status=AnalysisStatusChoices.SUCCEEDED,
+            experiment=self.experiment,
+            parameters={},
+        )
+        self.url = reverse('core:experiment-analysis-detail', kwargs={
+            'experiment_pk': self.experiment.pk, 'pk': self.analysis.pk,
+        })
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        # version only: the token is cached and nothing is serialized
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_no_last_modified(self):
+        self.assertNotIn('Last-Modified', self.client.get(self.url))
+
+    def test_finished_analysis_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        # version only
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+
+    def test_save_invalidates(self):
+        etag = self.client.get(self.url)['ETag']
+        self.analysis.title = 'renamed'
+        self.analysis.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['title'], 'renamed')
+
+    def test_related_rows_bump_version(self):
+        etag = self.client.get(self.url)['ETag']
+        analysis_input = AnalysisInput.objects.create(command='align', analysis=self.analysis)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['inputs']), 1)
+
+        etag = response['ETag']
+        AnalysisOutput.objects.create(results={'score': 1}, input=analysis_input)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['inputs'][0]['outputs'][0]['results'], {'score': 1})
+
+    def test_status_update_bumps_version(self):
+        self.analysis.status = AnalysisStatusChoices.STARTED
+        self.analysis.save(update_fields=['status'])
+        etag = self.client.get(self.url)['ETag']
+
+        self.analysis.status = AnalysisStatusChoices.SUCCEEDED
+        self.analysis.save(update_fields=['status'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_experiment_not_modified(self):
+        url = reverse('core:experiment-detail', kwargs={'pk': self.experiment.pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class ResultFileTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='user', password='password')
+        token = Token.objects.create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        experiment = Experiment.objects.create(title='experiment', description='', user=user)
+        self.analysis = Analysis.objects.create(
+            title='tree',
+            type=AnalysisTypeChoices.TAXONOMY_TREE,
+            status=AnalysisStatusChoices.SUCCEEDED,
+            experiment=experiment,
+            parameters={},
+        )
+
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        patcher = mock.patch('core.storage.STORAGE_FILE', storage.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.content = b'((a:0.1,b:0.2):0.3,c:0.4);'
+        path = os.path.join(storage.name, 'tree.nwk')
+        with open(path, 'wb') as fh:
+            fh.write(self.content)
+        analysis_input = AnalysisInput.objects.create(command='command', analysis=self.analysis)
+        self.output = AnalysisOutput.objects.create(file=path, input=analysis_input)
+        self.url = reverse('core:experiment-analysis-result-file', kwargs={
+            'experiment_pk': experiment.pk, 'pk': self.analysis.pk, 'output_pk': self.output.pk,
+        })
+
+    def test_results_link_to_file(self):
+        url = reverse('core:experiment-analysis-results', kwargs={
+            'experiment_pk': self.analysis.experiment_id, 'pk': self.analysis.pk,
+        })
+        output = self.client.get(url).json()['results'][0]
+        self.assertTrue(output['file_url'].endswith(self.url))
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/x-nh')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 2-5/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[2:6])
+
+    def test_suffix_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[-3:])
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_file_outside_storage(self):
+        self.output.file = '/etc/passwd'
+        self.output.save(update_fields=['file'])
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ResultEntriesTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='user', password='password')
+        token = Token.objects.create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        experiment = Experiment.objects.create(title='experiment', description='', user=user)
+        self.analysis = Analysis.objects.create(
+            title='search',
+            type=AnalysisTypeChoices.HOMOLOGY_SEARCH,
+            status=AnalysisStatusChoices.SUCCEEDED,
+            experiment=experiment,
+            parameters={},
+        )
+        self.hits = [{'subject': f'hit{i}', 'bitscore': float(i)} for i in range(10)]
+        analysis_input = AnalysisInput.objects.create(command='blastn', analysis=self.analysis)
+        self.output = AnalysisOutput.objects.create(results=self.hits, results_size=300, input=analysis_input)
+        kwargs = {'experiment_pk': experiment.pk, 'pk': self.analysis.pk}
+        self.results_url = reverse('core:experiment-analysis-results', kwargs=kwargs)
+        self.entries_url = reverse('core:experiment-analysis-result-entries', kwargs={
+            **kwargs, 'output_pk': self.output.pk,
+        })
+
+    def test_small_results_are_inlined(self):
+        output = self.client.get(self.results_url).json()['results'][0]
+        self.assertEqual(output['results'], self.hits)
+        self.assertTrue(output['entries_url'].endswith(self.entries_url))
+
+    def test_large_results_are_left_out(self):
+        with mock.patch('core.views.RESULTS_INLINE_MAX_BYTES', 299):
+            output = self.client.get(self.results_url).json()['results'][0]
+        self.assertIsNone(output['results'])
+        self.assertEqual(output['results_size'], 300)
+
+    def test_entries_are_paged(self):
+        page = self.client.get(self.entries_url, {'offset': 8, 'limit': 5}).json()
+        self.assertEqual(page, {'total': 10, 'offset': 8, 'limit': 5, 'entries': self.hits[8:]})
+
+    def test_entries_of_a_list_inside_the_results(self):
+        Analysis.objects.filter(pk=self.analysis.pk).update(type=AnalysisTypeChoices.PAIRWISE_ALIGNMENT)
+        AnalysisOutput.objects.filter(pk=self.output.pk).update(
+            results={'total': 10, 'truncated': False, 'alignments': self.hits},
+        )
+        page = self.client.get(self.entries_url, {'limit': 2}).json()
+        self.assertEqual((page['total'], page['entries']), (10, self.hits[:2]))
+
+    def test_results_without_entries(self):
+        Analysis.objects.filter(pk=self.analysis.pk).update(type=AnalysisTypeChoices.PAIRWISE_ALIGNMENT)
+        AnalysisOutput.objects.filter(pk=self.output.pk).update(results={'score': 1})
+        self.assertEqual(self.client.get(self.entries_url).status_code, 404)
+
+
+class StaleAnalysisTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='user', password='password')
+        self.experiment = Experiment.objects.create(title='experiment', description='', user=user)
+
+    def _analysis(self, status, heartbeat_age=None):
+        analysis = Analysis.objects.create(
+            title='search',
+            type=AnalysisTypeChoices.HOMOLOGY_SEARCH,
+            status=status,
+            experiment=self.experiment,
+            parameters={},
+        )
+        if heartbeat_age is not None:
+            Analysis.objects.filter(pk=analysis.pk).update(heartbeat_at=timezone.now() - heartbeat_age)
+        return analysis
+
+    def _status(self, analysis):
+        return Analysis.objects.values_list('status', flat=True).get(pk=analysis.pk)
+
+    def test_reaps_started_without_heartbeat(self):
+        stale = self._analysis(AnalysisStatusChoices.STARTED, heartbeat_age=timedelta(hours=1))
+        alive = self._analysis(AnalysisStatusChoices.STARTED, heartbeat_age=timedelta(seconds=1))
+        waiting = self._analysis(AnalysisStatusChoices.WAITING)
+        Analysis.objects.filter(pk=waiting.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(reap_stale_analyses(stale_after=60), 1)
+        self.assertEqual(self._status(stale), AnalysisStatusChoices.FAILED)
+        self.assertEqual(self._status(alive), AnalysisStatusChoices.STARTED)
+        self.assertEqual(self._status(waiting), AnalysisStatusChoices.WAITING)
+
+    def test_reaps_legacy_rows_by_updated_at(self):
+        analysis = self._analysis(AnalysisStatusChoices.STARTED)
+        Analysis.objects.filter(pk=analysis.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(reap_stale_analyses(stale_after=60), 1)
+        self.assertEqual(self._status(analysis), AnalysisStatusChoices.FAILED)
+
+    def test_beat_keeps_running_analyses_alive(self):
+        analysis = self._analysis(AnalysisStatusChoices.STARTED, heartbeat_age=timedelta(hours=1))
+        beats = AnalysisHeartbeat()
+        with mock.patch.object(beats, '_run'):
+            beats.add(analysis.id)
+        beats.beat()
+        self.assertEqual(reap_stale_analyses(stale_after=60), 0)
+
+    def test_redelivery_takes_over_analyses_without_a_live_worker(self):
+        orphaned = self._analysis(AnalysisStatusChoices.STARTED, heartbeat_age=timedelta(hours=1))
+        alive = self._analysis(AnalysisStatusChoices.STARTED, heartbeat_age=timedelta(seconds=1))
+
+        self.assertIsNone(start_analysis(orphaned.id))
+        self.assertEqual(start_analysis(orphaned.id, redelivered=True).pk, orphaned.pk)
+        # Now beating again, so a second redelivery leaves it to the new owner
+        self.assertIsNone(start_analysis(orphaned.id, redelivered=True))
+        self.assertIsNone(start_analysis(alive.id, redelivered=True))
+
+
+class PairwiseAlignmentLimitTests(TestCase):
+    parameters = {
+        'mode': 'global',
+        'match_score': 1,
+        'mismatch_score': -1,
+        'open_gap_score': -1,
+        'extend_gap_score': -0.5,
+        'output': 'score_only',
+    }
+
+    def test_score_only_bounds_the_product_of_lengths(self):
+        strategy = PairwiseAlignmentStrategy()
+        parameters = {**self.parameters, 'sequence_a': 'A' * 1000, 'sequence_b': 'A' * 300}
+        with mock.patch('core.strategies.PAIRWISE_MAX_CELLS', 299999):
+            with self.assertRaisesRegex(ValueError, 'len\\(sequence_a\\) \\* len\\(sequence_b\\)'):
+                strategy._validate_business_rules(parameters)
+        with mock.patch('core.strategies.PAIRWISE_MAX_CELLS', 300000):
+            strategy._validate_business_rules(parameters)
+
+
+@mock.patch.multiple('core.strategies', **QUEUE_CONSTANTS)
+class PairwiseBatchTests(TestCase):
+    parameters = {
+        'mode': 'global',
+        'match_score': 1,
+        'mismatch_score': -1,
+        'open_gap_score': -1,
+        'extend_gap_score': -0.5,
+    }
+
+    def setUp(self):
+        user = User.objects.create_user(username='user', password='password')
+        token = Token.objects.create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.experiment = Experiment.objects.create(title='experiment', description='', user=user)
+
+    def test_create_queues_the_batch(self):
+        url = reverse('core:experiment-analysis-list', kwargs={'experiment_pk': self.experiment.pk})
+        response = self.client.post(url, {
+            'title': 'batch',
+            'type': AnalysisTypeChoices.PAIRWISE_BATCH,
+            'parameters': {**self.parameters, 'queries': ['ACGT', 'ACGA', 'TTGA']},
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['status'], AnalysisStatusChoices.WAITING)
+        self.assertEqual(OutboxMessage.objects.get().body['analysis_id'], response.json()['id'])
+
+    def test_total_cells_are_capped(self):
+        strategy = PairwiseBatchStrategy()
+        parameters = {**self.parameters, 'queries': ['A' * 100] * 3, 'targets': ['A' * 50] * 2}
+        # 300 query bases x 100 target bases
+        self.assertEqual(strategy._count_cells(parameters), 30000)
+        with mock.patch('core.strategies.PAIRWISE_BATCH_MAX_CELLS', 29999):
+            with self.assertRaisesRegex(ValueError, 'alignment cells'):
+                strategy._validate_business_rules(parameters)
+
+    def test_all_vs_all_counts_the_upper_triangle(self):
+        parameters = {**self.parameters, 'queries': ['A' * 10, 'A' * 20]}
+        # 10*10 + 10*20 + 20*20
+        self.assertEqual(PairwiseBatchStrategy()._count_cells(parameters), 700)
+
+    def test_run_batch_scores_every_pair(self):
+        analysis = Analysis(parameters={**self.parameters, 'queries': ['ACGT', 'ACGT'], 'targets': ['ACGT']})
+        result = PairwiseBatchStrategy().run_batch(analysis, processes=1).result
+        self.assertEqual(result['scores'], [[4.0], [4.0]])
+
+
+@mock.patch.multiple('core.strategies', **QUEUE_CONSTANTS)
+class TaxonomyTreeTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='user', password='password')
+        token = Token.objects.create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.experiment = Experiment.objects.create(title='experiment', description='', user=user)
+
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        patcher = mock.patch('core.storage.STORAGE_FILE', storage.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_two_trees_from_one_parent(self):
+        parent = Analysis.objects.create(
+            title='search',
+            type=AnalysisTypeChoices.HOMOLOGY_SEARCH,
+            status=AnalysisStatusChoices.SUCCEEDED,
+            experiment=self.experiment,
+            parameters={},
+        )
+        url = reverse('core:experiment-analysis-list', kwargs={'experiment_pk': self.experiment.pk})
+        for title in ('tree', 'tree again'):
+            response = self.client.post(url, {
+                'title': title,
+                'type': AnalysisTypeChoices.TAXONOMY_TREE,
+                'parameters': {'generated_from_analysis': parent.pk},
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(parent.generated_analyses.count(), 2)
+
+    def test_cached_stage_reuses_artifact(self):
+        strategy = TaxonomyTreeStrategy()
+
+        def write_tree(out):
+            with open(out, 'w') as fh:
+                fh.write('tree;')
+
+        build = mock.Mock(side_effect=write_tree)
+        for analysis_id, hit in ((1, False), (2, True)):
+            path = os.path.join(analysis_storage_dir(analysis_id), 'tree.nwk')
+            self.assertEqual(strategy._cached_stage('key', path, build), hit)
+            with open(path) as fh:
+                self.assertEqual(fh.read(), 'tree;')
+        build.assert_called_once()
+        self.assertEqual([name for name in os.listdir(artifact_cache_dir()) if name.endswith('.partial')], [])
+
+    def test_artifact_cache_eviction(self):
+        now = time.time()
+        for name, size, age in (('old', 1, 10 ** 6), ('used', 30, 100), ('recent', 30, 0)):
+            path = os.path.join(artifact_cache_dir(), name)
+            with open(path, 'wb') as fh:
+                fh.write(b'x' * size)
+            os.utime(path, (now - age, now - age))
+
+        # 'old' is past the age limit; 'used' is the least recently used over the size limit
+        self.assertEqual(evict_artifact_cache(max_bytes=40, max_age_seconds=1000), 2)
+        self.assertEqual(os.listdir(artifact_cache_dir()), ['recent'])
+
+
+class StageTimingTests(TestCase):
+    def test_peak_rss_is_per_tool(self):
+        recorder = StageRecorder()
+        runner = ToolRunner(limits=ToolLimits(nice=0, ionice_class=0))
+        with recorder.stage('large', runner=runner):
+            runner.run([sys.executable, '-c', 'buffer = bytearray(200 * 1024 * 1024)'])
+        with recorder.stage('small', runner=runner):
+            runner.run([sys.executable, '-c', 'pass'])
+
+        large, small = recorder.stages
+        self.assertGreater(large.peak_rss_kb, 200 * 1024)
+        self.assertLess(small.peak_rss_kb, 200 * 1024)
+
+    def test_results_size_is_measured_on_the_stored_results(self):
+        user = User.objects.create_user(username='user', password='password')
+        experiment = Experiment.objects.create(title='experiment', description='', user=user)
+        analysis = Analysis.objects.create(
+            title='analysis', type=AnalysisTypeChoices.PAIRWISE_ALIGNMENT, experiment=experiment, parameters={},
+        )
+        store_execution_result(analysis, AnalysisExecutionResult(
+            type=ExecutionType.SYNC, command='align', result={'score': 1},
+        ))
+        self.assertEqual(AnalysisOutput.objects.get(input__analysis=analysis).results_size, len('{"score": 1}'))
+
+
+class ToolRunnerTests(SimpleTestCase):
+    def test_cpu_limit_scales_with_threads(self):
+        # RLIMIT_CPU adds up the CPU time of every thread of the tool
+        runner = ToolRunner(limits=ToolLimits(cpu_seconds=10, nice=0, ionice_class=0))
+        check = 'import resource, sys; sys.exit(resource.getrlimit(resource.RLIMIT_CPU)[0] != {})'
+        runner.run([sys.executable, '-c', check.format(10)])
+        runner.run([sys.executable, '-c', check.format(40)], threads=4)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('core:metrics')
+
+    def test_only_allowed_networks_without_a_token(self):
+        self.assertEqual(self.client.get(self.url, REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get(self.url, REMOTE_ADDR='203.0.113.7').status_code, 403)
+
+    def test_token_is_required_when_configured(self):
+        with mock.patch('core.permissions.METRICS_TOKEN', 'secret'):
+            self.assertEqual(self.client.get(self.url, REMOTE_ADDR='10.1.2.3').status_code, 403)
+            response = self.client.get(self.url, REMOTE_ADDR='203.0.113.7', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+    def test_stages_outside_the_window_are_left_out(self):
+        user = User.objects.create_user(username='user', password='password')
+        experiment = Experiment.objects.create(title='experiment', description='', user=user)
+        analysis = Analysis.objects.create(
+            title='analysis', type=AnalysisTypeChoices.HOMOLOGY_SEARCH, experiment=experiment, parameters={},
+        )
+        for stage in ('recent', 'old'):
+            AnalysisStageTiming.objects.create(
+                analysis=analysis, stage=stage, wall_seconds=1, cpu_seconds=1, peak_rss_kb=1,
+            )
+        AnalysisStageTiming.objects.filter(stage='old').update(created_at=timezone.now() - timedelta(days=1))
+
+        body = self.client.get(self.url, REMOTE_ADDR='127.0.0.1').content.decode()
+        self.assertIn('stage="recent"', body)
+        self.assertNotIn('stage="old"', body)
+
+
+class FakeChannel:
+    """
+    Delivers the given bodies from start_consuming. Exceptions are raised in their
+    place and callables are run, e.g. to complete a job. Like pika's I/O loop, it runs
+    the connection's thread-safe callbacks after each step.
+    """
+
+    def __init__(self, deliveries, redelivered=False):
+        self.deliveries = deliveries
+        self.redelivered = redelivered
+        self.acked = []
+        self.nacked = []
+
+    def basic_qos(self, prefetch_count):
+        pass
+
+    def basic_consume(self, queue, on_message_callback):
+        self.on_message = on_message_callback
+
+    def start_consuming(self):
+        for tag, delivery in enumerate(self.deliveries, start=1):
+            if isinstance(delivery, Exception):
+                raise delivery
+            if callable(delivery):
+                delivery()
+            else:
+                self.on_message(self, mock.Mock(delivery_tag=tag, redelivered=self.redelivered), None, delivery)
+            self.connection.run_callbacks()
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.nacked.append((delivery_tag, requeue))
+
+
+class FakeConnection:
+    def __init__(self, channel):
+        self._channel = channel
+        self._channel.connection = self
+        self._callbacks = []
+        self.is_open = True
+
+    def channel(self):
+        return self._channel
+
+    def add_callback_threadsafe(self, callback):
+        if not self.is_open:
+            raise ConnectionWrongStateError()
+        self._callbacks.append(callback)
+
+    def run_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        self.is_open = False
+
+
+class RabbitmqConsumerTests(SimpleTestCase):
+    def _consumer(self, channels):
+        self.connections = [FakeConnection(channel) for channel in channels]
+        self.factory = mock.Mock(side_effect=self.connections)
+        return RabbitmqConsumer('queue', connection_parameters=mock.Mock(), connection_factory=self.factory)
+
+    def consume(self, *channels):
+        callback = mock.Mock(side_effect=lambda body, redelivered: body['ok'] or 1 / 0)
+        with mock.patch('core.rabbitmq_consumer.time.sleep') as sleep:
+            self._consumer(channels).consume(callback)
+        self.assertTrue(all(not connection.is_open for connection in self.connections))
+        return self.factory, sleep
+
+    def consume_async(self, channels, on_done):
+        """Consume with submit returning a pending future per message, kept in self.futures."""
+        self.futures = []
+        self.redelivered = []
+
+        def submit(body, redelivered):
+            self.redelivered.append(redelivered)
+            if not body['ok']:
+                raise ValueError('rejected')
+            self.futures.append(Future())
+            return self.futures[-1]
+
+        with mock.patch('core.rabbitmq_consumer.time.sleep'):
+            self._consumer(channels).consume_async(submit, on_done)
+
+    def _complete(self, index=0):
+        return lambda: self.futures[index].set_result('saved')
+
+    def test_acks_processed_and_nacks_failed_messages(self):
+        channel = FakeChannel([b'{"ok": true}', b'{"ok": false}', b'not json'])
+        self.consume(channel)
+        self.assertEqual(channel.acked, [1])
+        self.assertEqual(channel.nacked, [(2, False), (3, False)])
+
+    def test_reconnects_after_losing_the_broker(self):
+        lost = FakeChannel([b'{"ok": true}', AMQPConnectionError('lost')])
+        resumed = FakeChannel([b'{"ok": true}'])
+        factory, sleep = self.consume(lost, resumed)
+        self.assertEqual(factory.call_count, 2)
+        sleep.assert_called_once()
+        self.assertEqual((lost.acked, resumed.acked), ([1], [1]))
+
+    def test_async_acks_once_the_result_is_saved(self):
+        channel = FakeChannel([b'{"ok": true}', b'{"ok": true}', self._complete(0)])
+        on_done = mock.Mock(side_effect=lambda body, future: self.assertEqual(channel.acked, []))
+        self.consume_async([channel], on_done)
+        on_done.assert_called_once_with({'ok': True}, self.futures[0])
+        # The second job is still running
+        self.assertEqual(channel.acked, [1])
+
+    def test_async_nacks_failed_messages(self):
+        channel = FakeChannel([b'{"ok": false}', b'{"ok": true}', self._complete(0)])
+        self.consume_async([channel], mock.Mock(side_effect=RuntimeError('not saved')))
+        self.assertEqual(channel.nacked, [(1, False), (2, False)])
+        self.assertEqual(channel.acked, [])
+
+    def test_async_saves_jobs_that_outlive_the_connection(self):
+        lost = FakeChannel([b'{"ok": true}', AMQPConnectionError('lost')])
+        resumed = FakeChannel([self._complete(0), b'{"ok": true}'], redelivered=True)
+        on_done = mock.Mock()
+        self.consume_async([lost, resumed], on_done)
+
+        # The result is saved although its ack can no longer be sent
+        on_done.assert_called_once_with({'ok': True}, self.futures[0])
+        self.assertEqual((lost.acked, resumed.acked), ([], []))
+        self.assertEqual(self.redelivered, [False, True])
+
+
+class RabbitmqConfigurationTests(SimpleTestCase):
+    def test_incomplete_queue_settings_stop_startup(self):
+        environ = {key: value for key, value in os.environ.items() if not key.startswith('RABBITMQ_BLASTN_')}
+        with mock.patch.dict(os.environ, environ, clear=True):
+            with self.assertRaisesRegex(CommandError, 'RABBITMQ_BLASTN_QUEUE_NAME'):
+                call_command('initialize_rabbitmq')
+
+    def test_unconfigured_exchange_is_not_queued(self):
+        with self.assertRaises(ImproperlyConfigured):
+            enqueue_message(None, None, {'analysis_id': 1})
+
+
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        for analysis_id in (1, 2):
+            enqueue_message('exchange', 'routing_key', {'analysis_id': analysis_id})
+        self.channel = mock.Mock()
+        patcher = mock.patch('core.rabbitmq_producer._shared_connection.confirm_channel', return_value=self.channel)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_confirmed_messages_are_deleted(self):
+        self.assertEqual(relay_pending_messages(), 2)
+        self.assertEqual(self.channel.basic_publish.call_count, 2)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_nacked_messages_are_kept(self):
+        self.channel.basic_publish.side_effect = NackError([])
+        with self.assertRaises(NackError):
+            relay_pending_messages()
+        self.assertEqual(OutboxMessage.objects.count(), 2)
@@ -0,0 +1,174 @@
+# core/tool_runner.py
+from __future__ import annotations
+
+import logging
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Iterator, List, Optional
+
+from .constants import (
+    TOOL_TIMEOUT_SECONDS,
+    TOOL_MEMORY_LIMIT_MB,
+    TOOL_CPU_LIMIT_SECONDS,
+    TOOL_NICE,
+    TOOL_IONICE_CLASS,
+    TOOL_IONICE_LEVEL,
+    TOOL_POLL_INTERVAL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Grace period between SIGTERM and SIGKILL when stopping a process group
+KILL_GRACE_SECONDS = 5
+
+
+class ToolTimeout(Exception):
+    pass
+
+
+class ToolCancelled(Exception):
+    pass
+
+
+@dataclass
+class ToolLimits:
+    timeout: float = TOOL_TIMEOUT_SECONDS
+    memory_mb: int = TOOL_MEMORY_LIMIT_MB
+    cpu_seconds: int = TOOL_CPU_LIMIT_SECONDS
+    nice: int = TOOL_NICE
+    ionice_class: int = TOOL_IONICE_CLASS
+    ionice_level: int = TOOL_IONICE_LEVEL
+
+
+@dataclass
+class ToolRunner:
+    """
+    Runs external bioinformatics tools in their own process group with a wall-clock
+    timeout, memory/CPU rlimits and lowered CPU/IO priority. should_cancel is polled
+    while the tool runs; when it returns True the whole process group is killed.
+    Zero disables a limit.
+    """
+    should_cancel: Optional[Callable[[], bool]] = None
+    limits: ToolLimits = field(default_factory=ToolLimits)
+    # Peak RSS of each tool run so far, in run order, as reported by wait4
+    peak_rss_kb: List[int] = field(default_factory=list, init=False)
+
+    def run(self, cmd: List[str], stdout=None, env: Optional[dict] = None, threads: int = 1) -> None:
+        # open reaps the tool on exit; Popen.wait would discard its rusage
+        with self.open(cmd, stdout=stdout, env=env, threads=threads):
+            pass
+
+    @contextmanager
+    def open(self, cmd: List[str], stdout=None, env: Optional[dict] = None,
+             threads: int = 1) -> Iterator[subprocess.Popen]:
+        """
+        Start cmd and yield its Popen, e.g. to stream stdout=subprocess.PIPE. threads is
+        how many threads the tool was told to use: RLIMIT_CPU counts the CPU time of
+        all of them, so the CPU limit is scaled by it.
+        """
+        logger.info("Running: %s", ' '.join(cmd))
+        proc = subprocess.Popen(
+            self._ionice_prefix() + cmd,
+            stdout=stdout,
+            env=env,
+            text=True,
+            start_new_session=True,
+            preexec_fn=partial(self._apply_limits, max(1, threads)),
+        )
+        stopped = threading.Event()
+        reason: List[Exception] = []
+        watchdog = threading.Thread(target=self._watch, args=(cmd[0], proc, stopped, reason), daemon=True)
+        watchdog.start()
+        try:
+            yield proc
+        except BaseException:
+            self._terminate(proc)
+            raise
+        finally:
+            if proc.stdout:
+                proc.stdout.close()
+            self._reap(proc)
+            stopped.set()
+            watchdog.join()
+
+        if reason:
+            raise reason[0]
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    def _watch(self, name: str, proc: subprocess.Popen, stopped: threading.Event, reason: List[Exception]) -> None:
+        # Only the thread that started proc reaps it (see _reap); stopped is set once it has
+        deadline = time.monotonic() + self.limits.timeout if self.limits.timeout else None
+        while not stopped.wait(TOOL_POLL_INTERVAL_SECONDS):
+            if deadline is not None and time.monotonic() > deadline:
+                reason.append(ToolTimeout(f"{name} exceeded {self.limits.timeout}s"))
+            elif self.should_cancel is not None and self.should_cancel():
+                reason.append(ToolCancelled(f"{name} cancelled"))
+            else:
+                continue
+            self._kill(proc, stopped)
+            return
+
+    def _kill(self, proc: subprocess.Popen, stopped: threading.Event) -> None:
+        """Stop the process group from the watchdog, escalating if it is not reaped in time."""
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            if not stopped.wait(KILL_GRACE_SECONDS):
+                os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _terminate(self, proc: subprocess.Popen) -> None:
+        """Stop the process group from the thread that started it, reaping the tool."""
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.monotonic() + KILL_GRACE_SECONDS
+        while time.monotonic() < deadline:
+            if self._reap(proc, os.WNOHANG):
+                return
+            time.sleep(0.1)
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self, proc: subprocess.Popen, options: int = 0) -> bool:
+        """
+        Wait for proc with wait4 rather than Popen.wait: its rusage is this tool's own
+        peak RSS, where getrusage(RUSAGE_CHILDREN) is the high-water mark of every
+        child the worker ever reaped. Returns whether proc has been reaped.
+        """
+        if proc.returncode is not None:
+            return True
+        pid, status, usage = os.wait4(proc.pid, options)
+        if pid == 0:
+            return False
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        self.peak_rss_kb.append(usage.ru_maxrss)
+        return True
+
+    def _apply_limits(self, threads: int) -> None:
+        # Runs in the child between fork and exec
+        if self.limits.memory_mb:
+            size = self.limits.memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (size, size))
+        if self.limits.cpu_seconds:
+            cpu_seconds = self.limits.cpu_seconds * threads
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+        if self.limits.nice:
+            os.nice(self.limits.nice)
+
+    def _ionice_prefix(self) -> List[str]:
+        if not self.limits.ionice_class or shutil.which('ionice') is None:
+            return []
+        return ['ionice', '-c', str(self.limits.ionice_class), '-n', str(self.limits.ionice_level)]
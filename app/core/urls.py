@@ -1,7 +1,7 @@
 from django.urls import path
 from rest_framework.routers import SimpleRouter
 from rest_framework_nested.routers import NestedSimpleRouter
-from .views import ExperimentViewSet, AnalysisViewSet, RegisterView, LoginView
+from .views import ExperimentViewSet, AnalysisViewSet, RegisterView, LoginView, LogoutView, MetricsView, analysis_events
 
 router = SimpleRouter()
 router.register(r'experiment', ExperimentViewSet, basename='experiment')  # <- fix aqui
@@ -12,6 +12,19 @@ nested_router.register(r'analysis', AnalysisViewSet, basename='experiment-analys
 auth_urls = [
     path('auth/register/', RegisterView.as_view(), name='register'),
     path('auth/login/', LoginView.as_view(), name='login'),
+    path('auth/logout/', LogoutView.as_view(), name='logout'),
 ]
 
-urlpatterns = auth_urls + router.urls + nested_router.urls
\ No newline at end of file
+event_urls = [
+    path(
+        'experiment/<int:experiment_pk>/analysis/<int:pk>/events/',
+        analysis_events,
+        name='experiment-analysis-events',
+    ),
+]
+
+metrics_urls = [
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+]
+
+urlpatterns = auth_urls + event_urls + metrics_urls + router.urls + nested_router.urls
\ No newline at end of file
@@ -1,19 +1,50 @@
+import os
+
+from asgiref.sync import sync_to_async
 from django.db import transaction
+from django.db.models import Case, F, JSONField, Sum, Value, When
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 
 from rest_framework import viewsets, status, generics
+from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 
-from .models import Experiment, Analysis, AnalysisStatusChoices, AnalysisInput, AnalysisOutput
-from .serializers import ExperimentSerializer, AnalysisSerializer, UserSerializer
+from .models import Experiment, Analysis, AnalysisOutput, AnalysisStatusChoices, AnalysisTypeChoices
+from .constants import (
+    PAIRWISE_MAX_PAGE_OFFSET,
+    PAIRWISE_MAX_PAGE_SIZE,
+    RESULTS_INLINE_MAX_BYTES,
+    RESULTS_MAX_PAGE_OFFSET,
+    RESULTS_MAX_PAGE_SIZE,
+)
+from .serializers import (
+    ExperimentSerializer,
+    AnalysisSerializer,
+    AnalysisSummarySerializer,
+    AnalysisOutputListSerializer,
+    UserSerializer,
+)
 from .filters import ExperimentFilter, AnalysisFilter
 from .strategy_factory import StrategyFactory
 from .strategies import ExecutionType
-from .authentication import ExpiringTokenAuthentication 
+from .execution import store_execution_result
+from .metrics import render_metrics, PROMETHEUS_CONTENT_TYPE
+from .conditional import ConditionalRetrieveMixin
+from .notifications import status_events
+from .pagination import IdCursorPagination, OutputCursorPagination
+from .responses import ranged_file_response
+from .results import RESULT_ENTRIES_PATHS, page_result_entries
+from .storage import is_in_storage
+from .authentication import ExpiringTokenAuthentication
+from .permissions import IsMetricsScraper
 
 # ===================== AUTHENTICATION =======================
 
@@ -39,12 +70,23 @@ class LoginView(ObtainAuthToken):
         })
 
 
+class LogoutView(APIView):
+    authentication_classes = [ExpiringTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        # Deleting the token also evicts it from the authentication cache
+        request.auth.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 # ===================== EXPERIMENTS =======================
 
-class ExperimentViewSet(viewsets.ModelViewSet):
+class ExperimentViewSet(ConditionalRetrieveMixin, viewsets.ModelViewSet):
     authentication_classes = [ExpiringTokenAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = ExperimentSerializer
+    pagination_class = IdCursorPagination
     filterset_class = ExperimentFilter
     ordering_fields = ['id', 'created_at']
     ordering = ['-id']
@@ -58,20 +100,35 @@ class ExperimentViewSet(viewsets.ModelViewSet):
 
 # ===================== ANALYSIS =======================
 
-class AnalysisViewSet(viewsets.ModelViewSet):
+class AnalysisViewSet(ConditionalRetrieveMixin, viewsets.ModelViewSet):
     authentication_classes = [ExpiringTokenAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = AnalysisSerializer
+    pagination_class = IdCursorPagination
     filterset_class = AnalysisFilter
     ordering_fields = ['id']
     ordering = ['-id']
+    cached_statuses = (AnalysisStatusChoices.SUCCEEDED, AnalysisStatusChoices.FAILED)
+    # Nested in the representation, so their changes must change the ETag
+    version_relations = ('inputs', 'inputs__outputs', 'stage_timings')
 
     def get_queryset(self):
         experiment_id = self.kwargs.get('experiment_pk')
-        return Analysis.objects.filter(
+        queryset = Analysis.objects.filter(
             experiment__id=experiment_id,
             experiment__user=self.request.user
         )
+        if self.action == 'list':
+            # Parameters and results can be megabytes each; the list only reports sizes
+            return queryset.defer('parameters').annotate(results_size=Sum('inputs__outputs__results_size'))
+        if self.action in ('alignments', 'results', 'result_file', 'result_entries'):
+            return queryset
+        return queryset.prefetch_related('inputs__outputs', 'stage_timings')
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return AnalysisSummarySerializer
+        return super().get_serializer_class()
 
     @transaction.atomic
     def create(self, request, *args, **kwargs):
@@ -90,19 +147,7 @@ class AnalysisViewSet(viewsets.ModelViewSet):
                 headers = self.get_success_headers(serializer.data)
                 return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-            analysis.status = AnalysisStatusChoices.SUCCEEDED
-            analysis.save(update_fields=['status'])
-
-            analysis_input = AnalysisInput.objects.create(
-                command=execution.command,
-                analysis=analysis,
-            )
-
-            AnalysisOutput.objects.create(
-                results=execution.result,
-                file=execution.file,
-                input=analysis_input,
-            )
+            store_execution_result(analysis, execution)
 
             headers = self.get_success_headers(serializer.data)
             return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -110,4 +155,134 @@ class AnalysisViewSet(viewsets.ModelViewSet):
         except Exception as e:
             analysis.status = AnalysisStatusChoices.FAILED
             analysis.save(update_fields=['status'])
-            raise e
\ No newline at end of file
+            raise e
+
+    @action(detail=True, methods=['get'])
+    def alignments(self, request, *args, **kwargs):
+        analysis = self.get_object()
+        if analysis.type != AnalysisTypeChoices.PAIRWISE_ALIGNMENT:
+            raise ValidationError('Alignments are only available for PAIRWISE_ALIGNMENT analyses')
+        if analysis.status != AnalysisStatusChoices.SUCCEEDED:
+            raise ValidationError('Analysis must be SUCCEEDED')
+        if analysis.parameters.get('output', 'all') == 'score_only':
+            raise ValidationError('Alignments are not available for score_only analyses')
+
+        offset = self._int_query_param('offset', 0, 0, PAIRWISE_MAX_PAGE_OFFSET)
+        limit = self._int_query_param('limit', api_settings.PAGE_SIZE, 1, PAIRWISE_MAX_PAGE_SIZE)
+
+        strategy = StrategyFactory.get_strategy(analysis.type)
+        return Response(strategy.page_alignments(analysis.parameters, offset, limit))
+
+    @action(detail=True, methods=['get'])
+    def results(self, request, *args, **kwargs):
+        analysis = self.get_object()
+        pageable = analysis.type in RESULT_ENTRIES_PATHS
+        inline_results = F('results')
+        if pageable:
+            # Hit lists and alignments run to many MB in one output: those are paged by entry
+            inline_results = Case(
+                When(results_size__gt=RESULTS_INLINE_MAX_BYTES, then=Value(None, output_field=JSONField())),
+                default=F('results'),
+                output_field=JSONField(),
+            )
+        outputs = (
+            AnalysisOutput.objects.filter(input__analysis=analysis)
+            .defer('results')
+            .annotate(inline_results=inline_results)
+        )
+        # Not self.paginator: the view's ordering filter would impose the analysis ordering
+        paginator = OutputCursorPagination()
+        page = paginator.paginate_queryset(outputs, request)
+        serializer = AnalysisOutputListSerializer(
+            page, many=True, context={**self.get_serializer_context(), 'pageable': pageable},
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path=r'results/(?P<output_pk>[^/.]+)/entries')
+    def result_entries(self, request, *args, output_pk=None, **kwargs):
+        analysis = self.get_object()
+        path = RESULT_ENTRIES_PATHS.get(analysis.type)
+        if path is None:
+            raise ValidationError(f'{analysis.type} results have no entries to page')
+
+        offset = self._int_query_param('offset', 0, 0, RESULTS_MAX_PAGE_OFFSET)
+        limit = self._int_query_param('limit', api_settings.PAGE_SIZE, 1, RESULTS_MAX_PAGE_SIZE)
+        try:
+            outputs = AnalysisOutput.objects.filter(pk=output_pk, input__analysis=analysis)
+            page = page_result_entries(outputs, path, offset, limit)
+        except (TypeError, ValueError):
+            page = None
+        if page is None:
+            raise Http404('Output has no result entries')
+        return Response(page)
+
+    @action(detail=True, methods=['get'], url_path=r'results/(?P<output_pk>[^/.]+)/file')
+    def result_file(self, request, *args, output_pk=None, **kwargs):
+        # Outputs such as the BLAST archive run to hundreds of MB: stream them, with Range support
+        analysis = self.get_object()
+        output = get_object_or_404(
+            AnalysisOutput.objects.only('file'), pk=output_pk, input__analysis=analysis,
+        )
+        if not output.file or not is_in_storage(output.file) or not os.path.isfile(output.file):
+            raise Http404('Output has no stored file')
+        return ranged_file_response(request, output.file)
+
+    @action(detail=True, methods=['post'])
+    @transaction.atomic
+    def cancel(self, request, *args, **kwargs):
+        # Workers poll for CANCELLED and kill the running tool's process group
+        analysis = self.get_object()
+        analysis = Analysis.objects.select_for_update().get(pk=analysis.pk)
+        if analysis.status not in (AnalysisStatusChoices.WAITING, AnalysisStatusChoices.STARTED):
+            raise ValidationError(f'Analysis is {analysis.status} and can no longer be cancelled')
+
+        analysis.status = AnalysisStatusChoices.CANCELLED
+        analysis.save(update_fields=['status'])
+        return Response(self.get_serializer(analysis).data)
+
+    def _int_query_param(self, name, default, minimum, maximum):
+        value = self.request.query_params.get(name, default)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({name: 'Must be an integer'})
+        if not minimum <= value <= maximum:
+            raise ValidationError({name: f'Must be between {minimum} and {maximum}'})
+        return value
+
+
+async def analysis_events(request, experiment_pk, pk):
+    """
+    Server-Sent Events stream of an analysis' status, replacing polling of the
+    detail endpoint. Plain async Django view: DRF views cannot stream asynchronously.
+    """
+    try:
+        authenticated = await sync_to_async(ExpiringTokenAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if authenticated is None:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED,
+        )
+
+    user, _ = authenticated
+    owned = await Analysis.objects.filter(pk=pk, experiment__id=experiment_pk, experiment__user=user).aexists()
+    if not owned:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    response = StreamingHttpResponse(status_events(int(pk)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ===================== METRICS =======================
+
+class MetricsView(APIView):
+    """Prometheus scrape endpoint with per-stage analysis timings."""
+    authentication_classes = []
+    permission_classes = [IsMetricsScraper]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
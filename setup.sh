@@ -5,7 +5,11 @@ apt-get update
 
 echo "Installing dependencies"
 # troque 'muscle' por 'muscle3' (v3.x com -in/-out)
-apt-get install -y wget libgomp1 ncbi-blast+ fasttree muscle3 curl
+# muscle (v5), mafft e fasttreeMP são engines opcionais do TaxonomyTreeStrategy
+apt-get install -y wget libgomp1 ncbi-blast+ fasttree muscle3 muscle mafft curl
+
+# MUSCLE 5 fica disponível como 'muscle5'
+ln -sf /usr/bin/muscle /usr/local/bin/muscle5
 
 # opcional: manter o nome 'muscle' apontando para o binário do muscle3
 ln -sf /usr/bin/muscle3 /usr/local/bin/muscle